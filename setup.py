@@ -23,7 +23,7 @@ setup(
     keywords=["memoize", "cache"],
     url="https://github.com/Jon-Burr/memoclass.git",
     install_requires=[
-        "future",
+        'future;python_version<"3.0"',
         'funcsigs;python_version<"3.0"'
         ],
     python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, !=3.4.*',
@@ -0,0 +1,557 @@
+""" Alternative cache types for use with memoized functions and methods """
+
+import sys
+if sys.version_info[0] >= 3:
+    from collections.abc import MutableMapping
+else:
+    from builtins import object
+    from collections import MutableMapping
+from collections import deque, OrderedDict
+import hashlib
+import weakref
+
+if hasattr(hashlib, "blake2b"):
+    def _new_hash():
+        return hashlib.blake2b(digest_size=16)
+else:
+    _new_hash = hashlib.sha1
+
+# Types which are encoded in a digest by their repr
+_REPR_TYPES = frozenset((int, float, complex, bool, str, bytes, type(u""),
+                         type(None) ) )
+
+class _Box(object):
+    """ Wraps a value which does not support weak references """
+    __slots__ = ("value", "__weakref__")
+
+    def __init__(self, value):
+        self.value = value
+
+class WeakValueCache(MutableMapping):
+    """ A cache which only holds weak references to its values
+
+        Values are removed from the cache once nothing else refers to them. A
+        small ring of strong references to the most recently used values is
+        kept so that these survive between calls.
+
+        Values which do not support weak references (e.g. ints, tuples or
+        lists) are wrapped in a box, which is only kept alive by the ring. These
+        values therefore drop out of the cache once they leave the ring.
+    """
+    def __init__(self, ring_size=16):
+        """ Create the cache
+
+            :param ring_size:
+                The number of recently used values to keep strong references
+                to
+        """
+        self._data = weakref.WeakValueDictionary()
+        self._ring = deque(maxlen=ring_size)
+
+    def __getitem__(self, key):
+        stored = self._data[key]
+        self._ring.append(stored)
+        return stored.value if isinstance(stored, _Box) else stored
+
+    def __setitem__(self, key, value):
+        try:
+            weakref.ref(value)
+            stored = value
+        except TypeError:
+            stored = _Box(value)
+        self._ring.append(stored)
+        self._data[key] = stored
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(list(self._data.keys() ) )
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
+        self._ring.clear()
+
+    def __reduce__(self):
+        # Weak references can't be pickled, so store the live entries instead
+        items = []
+        for key in self:
+            try:
+                items.append((key, self[key]) )
+            except KeyError:
+                pass
+        return (type(self), (self._ring.maxlen,), None, None, iter(items) )
+
+class VersionedCache(MutableMapping):
+    """ A cache whose entries are checked against their owner's version stamp
+
+        Each entry records the stamp returned by the owner's memo_stamp method
+        when it was stored. When an entry is read its stamp is compared to the
+        owner's current stamp and if they differ, the entry is discarded. This
+        means that invalidation is only paid for entries that are actually
+        read.
+
+        Entries added through restore are only stamped when the cache is next
+        used, as the objects that the owner depends on may not be ready yet
+        (e.g. while unpickling).
+
+        Only a weak reference to the owner is held.
+    """
+    def __init__(self, owner, inner=None):
+        """ Create the cache
+
+            :param owner: The object whose memo_stamp is used
+            :param inner: The mapping to store entries in, by default a dict
+        """
+        self._owner = weakref.ref(owner)
+        self._inner = {} if inner is None else inner
+        # Restored entries which have not been stamped yet
+        self._unstamped = {}
+
+    def _stamp(self):
+        owner = self._owner()
+        return None if owner is None else owner.memo_stamp()
+
+    def restore(self, entries):
+        """ Add entries which are valid for the owner's current state
+
+            The entries are stamped when the cache is next used
+        """
+        self._unstamped.update(entries)
+
+    def _settle(self):
+        """ Stamp any restored entries """
+        unstamped, self._unstamped = self._unstamped, {}
+        stamp = self._stamp()
+        for key, value in unstamped.items():
+            self._inner[key] = (stamp, value)
+
+    def __getitem__(self, key):
+        if self._unstamped:
+            self._settle()
+        stamp, value = self._inner[key]
+        if stamp is None or stamp != self._stamp():
+            del self._inner[key]
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if self._unstamped:
+            self._settle()
+        self._inner[key] = (self._stamp(), value)
+
+    def __delitem__(self, key):
+        if self._unstamped:
+            self._settle()
+        del self._inner[key]
+
+    def __iter__(self):
+        if self._unstamped:
+            self._settle()
+        stamp = self._stamp()
+        return iter([k for k, (s, _) in list(self._inner.items() )
+                     if s == stamp])
+
+    def __len__(self):
+        return len(list(iter(self) ) )
+
+    def clear(self):
+        self._inner.clear()
+        self._unstamped.clear()
+
+    def memory_parts(self):
+        """ The mappings holding entries in memory, used by the cache manager
+        """
+        parts = getattr(self._inner, "memory_parts", None)
+        return (self,) if parts is None else parts()
+
+    def evictable_parts(self):
+        """ The mappings which the cache manager can evict entries from """
+        parts = getattr(self._inner, "evictable_parts", None)
+        return (self,) if parts is None else parts()
+
+    def prune(self):
+        """ Remove the entries whose stamps are out of date
+
+            :return: The number of entries removed
+        """
+        if self._unstamped:
+            self._settle()
+        stamp = self._stamp()
+        peek = getattr(self._inner, "peek", None)
+        removed = 0
+        for key in list(self._inner):
+            try:
+                s = (self._inner[key] if peek is None else peek(key) )[0]
+                if s is None or s != stamp:
+                    del self._inner[key]
+                    removed += 1
+            except KeyError:
+                pass
+        return removed
+
+    def snapshot(self):
+        """ Get a dictionary of the currently valid entries """
+        if self._unstamped:
+            self._settle()
+        stamp = self._stamp()
+        return dict((k, v) for k, (s, v) in list(self._inner.items() )
+                    if s == stamp)
+
+class LRUCache(MutableMapping):
+    """ A cache holding a limited number of entries
+
+        When the cache is full the least recently used entry is discarded
+    """
+    def __init__(self, maxsize=128):
+        """ Create the cache
+
+            :param maxsize: The maximum number of entries to hold
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __getitem__(self, key):
+        # Move the entry to the end
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(list(self._data) )
+
+    def peek(self, key):
+        """ Get a value without marking it as recently used """
+        return self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
+
+class TieredCache(MutableMapping):
+    """ A small, fast cache (L1) in front of a larger, slower one (L2)
+
+        Lookups check L1 first, then L2. Any value found in L2 is promoted into
+        L1. New values are written to both tiers, either immediately
+        (write-through) or, if write_back is set, in batches when flush is
+        called or batch_size values are waiting. Deleting or clearing always
+        affects every tier.
+
+        L2 can be any mutable mapping accepting the cache keys, for example a
+        mapping backed by a shared store or a file. When used with memomethod,
+        note that the keys do not include the bound object, so every object
+        needs its own L2.
+    """
+    def __init__(self, l2, l1=None, write_back=False, batch_size=None):
+        """ Create the cache
+
+            :param l2: The second tier
+            :param l1: The first tier, by default an LRUCache
+            :param write_back:
+                If True, new values are only written to L2 when flush is called
+                or when batch_size values are waiting
+            :param batch_size:
+                With write_back, the number of waiting values that triggers a
+                flush. If None, values are only written when flush is called
+        """
+        self.l1 = LRUCache() if l1 is None else l1
+        self.l2 = l2
+        self.write_back = write_back
+        self.batch_size = batch_size
+        self._pending = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.l1[key]
+        except KeyError:
+            pass
+        if key in self._pending:
+            value = self._pending[key]
+        else:
+            value = self.l2[key]
+        self.l1[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.l1[key] = value
+        if self.write_back:
+            self._pending[key] = value
+            if self.batch_size is not None and \
+                    len(self._pending) >= self.batch_size:
+                self.flush()
+        else:
+            self.l2[key] = value
+
+    def __delitem__(self, key):
+        found = False
+        for tier in (self.l1, self._pending, self.l2):
+            try:
+                del tier[key]
+                found = True
+            except KeyError:
+                pass
+        if not found:
+            raise KeyError(key)
+
+    def __iter__(self):
+        seen = set()
+        for tier in (self.l1, self._pending, self.l2):
+            for key in list(tier):
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def peek(self, key):
+        """ Get a value without promoting it or marking it as used """
+        peek = getattr(self.l1, "peek", None)
+        try:
+            return self.l1[key] if peek is None else peek(key)
+        except KeyError:
+            pass
+        if key in self._pending:
+            return self._pending[key]
+        return self.l2[key]
+
+    def clear(self):
+        self.l1.clear()
+        self._pending.clear()
+        self.l2.clear()
+
+    def memory_parts(self):
+        """ The mappings holding entries in memory, used by the cache manager
+        """
+        return (self.l1, self._pending)
+
+    def evictable_parts(self):
+        """ The mappings which the cache manager can evict entries from
+
+            Only L1 is included: the waiting values have not been written to L2
+            yet and L2 may be shared with other processes
+        """
+        return (self.l1,)
+
+    def flush(self):
+        """ Write any waiting values to L2 """
+        pending, self._pending = self._pending, {}
+        for key, value in pending.items():
+            self.l2[key] = value
+
+class _Digest(bytes):
+    """ Marks a digest standing in for a key which was not kept """
+    __slots__ = ()
+
+def _feed(update, key):
+    """ Feed the canonical encoding of a key into a hash function
+
+        Keys of the simple built in types are encoded by their repr, tuples by
+        their elements in order and frozensets by the sorted digests of their
+        elements, so equal keys built from these give equal digests in any
+        process. Anything else is encoded by its type and hash.
+    """
+    kind = type(key)
+    if kind in _REPR_TYPES:
+        data = repr(key).encode("utf-8")
+        update("{0}:{1}:".format(kind.__name__, len(data) ).encode("ascii") )
+        update(data)
+    elif isinstance(key, tuple):
+        update("T{0}:".format(len(key) ).encode("ascii") )
+        for element in key:
+            _feed(update, element)
+    elif isinstance(key, frozenset):
+        update("F{0}:".format(len(key) ).encode("ascii") )
+        for digest in sorted(_digest(element) for element in key):
+            update(digest)
+    else:
+        update("?{0}:{1}:".format(
+            kind.__name__, hash(key) ).encode("utf-8") )
+
+def _digest(key):
+    """ Get the fixed size digest of a key """
+    h = _new_hash()
+    _feed(h.update, key)
+    return h.digest()
+
+class CompactKeyCache(MutableMapping):
+    """ A cache which stores fixed size digests of its keys
+
+        The keys built for calls with large structured arguments (nested tuples
+        and frozensets) can take more memory than the values cached for them.
+        This cache stores its entries in an inner mapping under a 16 byte
+        digest of the key instead.
+
+        If verify is True the key is kept alongside the value and compared
+        against the requested key whenever their digests match, so a collision
+        can only cause a cache miss. As the full key is kept this does not save
+        memory by itself, but the parts of the stored keys (i.e. the arguments,
+        with their names for keyword arguments) are interned, so that arguments
+        repeated between calls are only stored once. When the arguments are all
+        different this uses about as much memory as a plain dict.
+
+        If verify is False only the digest is kept, which saves the most memory
+        but means that two keys with the same digest are treated as the same.
+        For keys built from the simple built in types the chance of this is
+        negligible, but other objects are only digested through their hash, so
+        this should only be used if all arguments are built from simple types.
+        Iterating over this cache gives the digests rather than the keys, which
+        can be used to read or delete the entries.
+
+        If the inner mapping discards entries by itself (e.g. an LRUCache), the
+        interned parts of their keys are not released straight away. Instead
+        the intern table is recounted from the stored keys whenever it has
+        doubled in size since it was last counted.
+    """
+    def __init__(self, inner=None, verify=True):
+        """ Create the cache
+
+            :param inner: The mapping to store entries in, by default a dict
+            :param verify: Whether to keep the keys to check against
+        """
+        self._inner = {} if inner is None else inner
+        self.verify = verify
+        # Map each interned part of the stored keys to the canonical copy of
+        # it and the number of times that it is used
+        self._interned = {}
+        # The size of the intern table when it was last recounted
+        self._counted_size = 0
+
+    def _intern(self, part):
+        """ Get the canonical copy of a part of a key, storing it if new """
+        if not isinstance(part, (tuple, frozenset) ):
+            return part
+        entry = self._interned.get(part)
+        if entry is not None:
+            entry[1] += 1
+            return entry[0]
+        self._interned[part] = [part, 1]
+        return part
+
+    def _rebuild(self, key):
+        """ Rebuild a key out of the canonical copies of its parts """
+        if isinstance(key, tuple):
+            return tuple(self._intern(part) for part in key)
+        elif isinstance(key, frozenset):
+            return frozenset(self._intern(part) for part in key)
+        return key
+
+    def _release(self, key):
+        """ Release the interned parts of a key which is no longer stored """
+        if not isinstance(key, (tuple, frozenset) ):
+            return
+        for part in key:
+            entry = self._interned.get(part)
+            if entry is None:
+                continue
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._interned[part]
+
+    def _recount(self):
+        """ Rebuild the intern table from the keys that are still stored
+
+            This drops the parts of keys which the inner mapping discarded
+        """
+        self._interned = {}
+        for digest in list(self._inner):
+            try:
+                key = self._peek_inner(digest)[0]
+            except KeyError:
+                continue
+            if isinstance(key, (tuple, frozenset) ):
+                for part in key:
+                    self._intern(part)
+        self._counted_size = len(self._interned)
+
+    def memory_parts(self):
+        """ The mappings holding entries in memory, used by the cache manager
+        """
+        parts = getattr(self._inner, "memory_parts", None)
+        return (self,) if parts is None else parts()
+
+    def evictable_parts(self):
+        """ The mappings which the cache manager can evict entries from """
+        parts = getattr(self._inner, "evictable_parts", None)
+        return (self,) if parts is None else parts()
+
+    def _lookup(self, key):
+        """ Get the digest of a key and the key to check the entry against """
+        if isinstance(key, _Digest):
+            return key, None
+        return _digest(key), key
+
+    def _unpack(self, stored, key):
+        if not self.verify:
+            return stored
+        stored_key, value = stored
+        if key is not None and stored_key is not key and stored_key != key:
+            raise KeyError(key)
+        return value
+
+    def __getitem__(self, key):
+        digest, key = self._lookup(key)
+        return self._unpack(self._inner[digest], key)
+
+    def _peek_inner(self, digest):
+        peek = getattr(self._inner, "peek", None)
+        return self._inner[digest] if peek is None else peek(digest)
+
+    def peek(self, key):
+        """ Get a value without marking it as used in the inner mapping """
+        digest, key = self._lookup(key)
+        return self._unpack(self._peek_inner(digest), key)
+
+    def __setitem__(self, key, value):
+        digest, key = self._lookup(key)
+        if not self.verify:
+            self._inner[digest] = value
+            return
+        if key is None:
+            raise KeyError("A digest cannot be stored when verifying keys")
+        try:
+            self._release(self._inner[digest][0])
+        except KeyError:
+            pass
+        self._inner[digest] = (self._rebuild(key), value)
+        if len(self._interned) > 2 * self._counted_size + 64:
+            self._recount()
+
+    def __delitem__(self, key):
+        digest, key = self._lookup(key)
+        if self.verify:
+            stored_key = self._inner[digest][0]
+            if key is not None and stored_key != key:
+                raise KeyError(key)
+            del self._inner[digest]
+            self._release(stored_key)
+        else:
+            del self._inner[digest]
+
+    def __iter__(self):
+        if self.verify:
+            return iter([self._peek_inner(digest)[0]
+                         for digest in list(self._inner)])
+        return iter([_Digest(digest) for digest in list(self._inner)])
+
+    def __len__(self):
+        return len(self._inner)
+
+    def clear(self):
+        self._inner.clear()
+        self._interned.clear()
+        self._counted_size = 0
@@ -0,0 +1,224 @@
+""" A process-wide registry of memo caches which can release memory under
+    pressure
+"""
+
+from itertools import islice
+import gc
+import sys
+import weakref
+if sys.version_info[0] < 3:
+    from builtins import object
+
+def _peek(cache, key):
+    """ Read a cache entry without marking it as used, if possible """
+    peek = getattr(cache, "peek", None)
+    return cache[key] if peek is None else peek(key)
+
+def _local_parts(cache, hook):
+    """ Get the parts of a cache held in this process' memory
+
+        Caches which keep some entries elsewhere (e.g. a TieredCache with a
+        shared or on-disk L2) can define memory_parts, returning the mappings
+        whose sizes should be counted, and evictable_parts, returning the
+        mappings from which entries can be evicted. Returns None if the whole
+        cache should be used.
+    """
+    parts = getattr(cache, hook, None)
+    if parts is None:
+        return None
+    parts = parts()
+    if len(parts) == 1 and parts[0] is cache:
+        return None
+    return parts
+
+def _prune(cache):
+    """ Remove any out of date entries from a cache, e.g. a VersionedCache
+
+        These are not seen when iterating over the cache, so are otherwise
+        neither counted nor evicted. Returns the number of entries removed.
+    """
+    prune = getattr(cache, "prune", None)
+    return 0 if prune is None else prune()
+
+def _estimate_size(cache, sample=100):
+    """ Estimate the memory used by a cache in bytes
+
+        Only the shallow sizes of the keys and values are counted. For caches
+        with more than sample entries, the size is extrapolated from the first
+        sample entries. Out of date entries are removed first. Only the parts
+        of the cache held in memory are counted.
+    """
+    parts = _local_parts(cache, "memory_parts")
+    if parts is not None:
+        return sum(_estimate_size(part, sample) for part in parts)
+    _prune(cache)
+    n = len(cache)
+    if n == 0:
+        return sys.getsizeof(cache)
+    total = 0
+    counted = 0
+    for key in list(islice(iter(cache), sample) ):
+        try:
+            value = _peek(cache, key)
+        except KeyError:
+            continue
+        total += sys.getsizeof(key) + sys.getsizeof(value)
+        counted += 1
+    if counted == 0:
+        return sys.getsizeof(cache)
+    return sys.getsizeof(cache) + total * n // counted
+
+def _evict(cache, fraction):
+    """ Remove the oldest fraction of the entries in a cache
+
+        For dicts these are the entries that were stored longest ago and for
+        LRUCaches the entries that were used longest ago. Any out of date
+        entries are removed first and count towards the fraction. Entries are
+        only removed from the parts of the cache held in memory, so nothing
+        stored elsewhere (e.g. in the L2 of a TieredCache) is touched. Returns
+        the number of entries removed.
+    """
+    parts = _local_parts(cache, "evictable_parts")
+    if parts is not None:
+        return sum(_evict(part, fraction) for part in parts)
+    pruned = _prune(cache)
+    if fraction >= 1:
+        n = len(cache)
+        cache.clear()
+        return pruned + n
+    n = int((len(cache) + pruned) * fraction + 0.5) - pruned
+    removed = pruned
+    for key in list(islice(iter(cache), max(n, 0) ) ):
+        try:
+            del cache[key]
+            removed += 1
+        except KeyError:
+            pass
+    return removed
+
+def current_rss():
+    """ Get the current resident set size of the process in bytes
+
+        Returns None if this cannot be determined. On Linux this is read from
+        /proc, elsewhere psutil is used if it is available.
+    """
+    try:
+        with open("/proc/self/statm") as fp:
+            pages = int(fp.read().split()[1])
+        import resource
+        return pages * resource.getpagesize()
+    except (IOError, OSError, ImportError, IndexError, ValueError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+class CacheManager(object):
+    """ Keeps track of all live memo caches
+
+        Every MemoFunc and MemoMethod registers itself with the manager in this
+        module. The manager can then estimate the memory used by all of their
+        caches and release some of it, either on demand or automatically when
+        installed as a garbage collector callback.
+    """
+    def __init__(self):
+        self._owners = weakref.WeakSet()
+        self.max_bytes = None
+        self.max_rss = None
+        self.fraction = 0.5
+        self._installed = False
+        self._checking = False
+
+    def register(self, owner):
+        """ Register an object owning memo caches
+
+            The object must have a _memo_caches method returning an iterable of
+            its caches. Only a weak reference to the owner is held.
+        """
+        self._owners.add(owner)
+
+    def caches(self):
+        """ Get a list of all live caches """
+        return [cache
+                for owner in list(self._owners)
+                for cache in owner._memo_caches()]
+
+    def estimate_size(self):
+        """ Estimate the memory used by all caches in bytes """
+        return sum(_estimate_size(cache) for cache in self.caches() )
+
+    def purge(self, fraction=1.):
+        """ Remove a fraction of the entries from every cache
+
+            The oldest entries in each cache are removed first.
+
+            :param fraction: The fraction of entries to remove from each cache
+            :return: The number of entries removed
+        """
+        return sum(_evict(cache, fraction) for cache in self.caches() )
+
+    def trim_to(self, nbytes):
+        """ Remove entries until the estimated size is below nbytes
+
+            This removes the same fraction of the entries from every cache,
+            the oldest entries in each cache first. It does not compare how
+            recently entries were used across different caches.
+
+            :return: The number of entries removed
+        """
+        size = self.estimate_size()
+        if size <= nbytes:
+            return 0
+        return self.purge(1. - float(nbytes) / size)
+
+    def check(self):
+        """ Apply the limits set by install
+
+            :return: The number of entries removed
+        """
+        if self._checking:
+            return 0
+        self._checking = True
+        try:
+            removed = 0
+            if self.max_bytes is not None:
+                removed += self.trim_to(self.max_bytes)
+            if self.max_rss is not None:
+                rss = current_rss()
+                if rss is not None and rss > self.max_rss:
+                    removed += self.purge(self.fraction)
+            return removed
+        finally:
+            self._checking = False
+
+    def _gc_callback(self, phase, info):
+        if phase == "stop" and info.get("generation") == 2:
+            self.check()
+
+    def install(self, max_bytes=None, max_rss=None, fraction=0.5):
+        """ Check the limits after every full garbage collection
+
+            :param max_bytes:
+                If not None, trim the caches to this estimated size
+            :param max_rss:
+                If not None and the resident set size of the process is larger
+                than this, purge the caches
+            :param fraction: The fraction of each cache to purge for max_rss
+        """
+        self.max_bytes = max_bytes
+        self.max_rss = max_rss
+        self.fraction = fraction
+        if not self._installed:
+            gc.callbacks.append(self._gc_callback)
+            self._installed = True
+
+    def uninstall(self):
+        """ Stop checking the limits after garbage collection """
+        if self._installed:
+            gc.callbacks.remove(self._gc_callback)
+            self._installed = False
+
+#: The manager with which all memo caches are registered
+cache_manager = CacheManager()
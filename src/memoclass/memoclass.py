@@ -1,10 +1,26 @@
-from builtins import object
+import os
+import sys
 from .memoize import (
         memoclsmethod, memomethod, memofunc, MemoMethod,
         MemoClsMethod, make_decorator)
 from functools import wraps
 from contextlib import contextmanager
-from future.utils import iteritems
+from itertools import count
+if sys.version_info[0] < 3:
+    from builtins import object
+
+# Source of version numbers for versioned caches. These are unique across all
+# objects so that a stamp cannot be repeated by a different set of objects
+_versions = count()
+# The most recently issued version number. Stamps computed since this last
+# changed are still valid
+_latest_version = None
+
+def _new_version():
+    """ Get a new version number """
+    global _latest_version
+    _latest_version = next(_versions)
+    return _latest_version
 
 def mutates(func):
     """ Signal that a method mutates its class
@@ -19,6 +35,78 @@ def mutates(func):
     inner.__wrapped__ = func
     return inner
 
+def _normalise_call(call):
+    """ Convert a precompute request into a (name, args, kwargs) tuple """
+    if isinstance(call, str):
+        return call, (), {}
+    elif len(call) == 2:
+        return call[0], tuple(call[1]), {}
+    else:
+        return call[0], tuple(call[1]), dict(call[2])
+
+def _call_memomethod(obj, name, args, kwargs):
+    """ Call a memomethod on an object. This is used by precompute and has to
+        be picklable, so that it can be used with process pools
+
+        Returns the id of the process that made the call, whether a cached
+        value is returned and the value as stored in the cache. The value is
+        only returned for memomethods without replay, as a replay buffer can't
+        be sent to another process.
+    """
+    bound = getattr(obj, name)
+    bound(*args, **kwargs)
+    if bound._replay:
+        return os.getpid(), False, None
+    try:
+        return os.getpid(), True, bound._cache[bound._make_key(args, kwargs)]
+    except KeyError:
+        return os.getpid(), False, None
+
+def precompute(objs, calls, executor=None):
+    """ Lock MemoClass objects and fill the caches of some of their memomethods
+
+        :param objs: The objects to precompute
+        :param calls:
+            The memomethod calls to make on each object. Each entry is either
+            the name of a memomethod to call without arguments or a tuple of
+            the name, the positional arguments and, optionally, the keyword
+            arguments
+        :param executor:
+            If not None, a concurrent.futures.Executor on which to make the
+            calls. If the calls are made in another process (e.g. with a
+            process pool) the objects are pickled and the results are stored
+            in the caches of the original objects. This is not possible for
+            memomethods using replay.
+    """
+    calls = [_normalise_call(call) for call in calls]
+    objs = list(objs)
+    for obj in objs:
+        if not obj.is_locked:
+            obj.lock()
+    if executor is None:
+        for obj in objs:
+            for name, args, kwargs in calls:
+                getattr(obj, name)(*args, **kwargs)
+        return
+    futures = [
+            (obj, name, args, kwargs,
+             executor.submit(_call_memomethod, obj, name, args, kwargs) )
+            for obj in objs
+            for name, args, kwargs in calls]
+    pid = os.getpid()
+    for obj, name, args, kwargs, future in futures:
+        worker, found, value = future.result()
+        if worker == pid:
+            # The cache of the original object is already filled
+            continue
+        bound = getattr(obj, name)
+        if bound._replay:
+            raise ValueError(
+                    "Cannot precompute replay memomethod {0} in another "
+                    "process".format(name) )
+        if found:
+            bound.add_to_cache(value, args, kwargs)
+
 class MemoClass(object):
     """ A class with several utilities to enable interacting with memoized
         methods
@@ -34,8 +122,32 @@ class MemoClass(object):
         that are difficult to reset the caches on (for example, if the class
         calculates values based on another object that it doesn't own or
         control).
+
+        The caches on a MemoClass can optionally be pickled along with it by
+        setting the pickle_caches class attribute. When the object is
+        unpickled, the caches are reattached to the new object.
+
+        Instead of clearing its caches when it is mutated, a MemoClass can use
+        versioned caches by setting the versioned_caches class attribute. Each
+        object then carries a version number which changes whenever it is
+        mutated and every cached result records the versions of the object and
+        of everything returned (recursively) by its depends_on method. A result
+        is only recalculated when it is read and one of these versions has
+        changed, so objects no longer need to know about the objects that
+        depend on them.
     """
 
+    #: Which memomethods should have their caches pickled along with the
+    #: object. If False no caches are pickled and if True all are. Otherwise,
+    #: this should either be a collection of memomethod names or a callable
+    #: which receives a memomethod name and returns whether its cache should be
+    #: included
+    pickle_caches = False
+
+    #: Whether to use versioned caches rather than clearing the caches when
+    #: the object is mutated
+    versioned_caches = False
+
     def __init__(self, mutable_attrs=()):
         """ Create the object
             
@@ -47,9 +159,10 @@ class MemoClass(object):
                 mutable
         """
         if mutable_attrs is not None:
-            mutable_attrs = \
-                    set(mutable_attrs) | set(("_locked", "_caches_enabled"))
+            mutable_attrs = set(mutable_attrs) | \
+                    set(("_locked", "_caches_enabled", "_memo_version"))
         self._locked = False
+        self._memo_version = _new_version()
         self._mutable_attrs = mutable_attrs
         self._memo_init = True
         self.enable_caches()
@@ -58,7 +171,7 @@ class MemoClass(object):
     def _memomethods(cls, base=True, clsmethods=False):
         """ List the memomethods associated with this class """
         if not base:
-            return set(k for k, v in iteritems(cls.__dict__)
+            return set(k for k, v in cls.__dict__.items()
                 if isinstance(v, MemoMethod) and
                 (clsmethods or not isinstance(v, MemoClsMethod) ) )
         else:
@@ -66,19 +179,72 @@ class MemoClass(object):
                     subcls._memomethods(False, clsmethods)
                     for subcls in cls.mro() if issubclass(subcls, MemoClass)))
 
+    @classmethod
+    def invalidate_caches(cls, clsmethods=False):
+        """ Invalidate the caches on all memomethods for every object
+
+            This is O(1) in the number of objects: each memomethod starts a new
+            generation and the stale caches are only cleared when they are next
+            used. Note that memomethods are shared with any base classes or
+            subclasses which have them, so this also affects their objects.
+        """
+        for m in cls._memomethods(clsmethods=clsmethods):
+            for subcls in cls.mro():
+                if m in subcls.__dict__:
+                    subcls.__dict__[m].invalidate()
+                    break
+
     def mutates_with_this(self):
         """ Return an iterable of objects whose mutate method should be called
             when this one is
         """
         return ()
 
+    def depends_on(self):
+        """ Return an iterable of MemoClass objects that the results of this
+            object's memomethods depend on
+
+            This is only used by versioned caches. The result should only
+            change when some object's version changes, e.g. it should not
+            depend on mutable attributes, as memo_stamp caches the stamp until
+            then.
+        """
+        return ()
+
+    def memo_stamp(self):
+        """ Get the version stamp used to validate versioned cache entries
+
+            This contains the versions of this object and of everything that it
+            (recursively) depends on. Walking the dependencies is only done
+            when a new version has been issued to any object since the stamp
+            was last calculated.
+        """
+        cached = self.__dict__.get("_memo_stamp")
+        if cached is not None and cached[0] == _latest_version:
+            return cached[1]
+        stamp = []
+        seen = set()
+        stack = [self]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj) )
+            stamp.append(obj._memo_version)
+            stack.extend(obj.depends_on() )
+        stamp = tuple(stamp)
+        # Go through __dict__ to bypass __setattr__
+        self.__dict__["_memo_stamp"] = (_latest_version, stamp)
+        return stamp
+
     def mutate(self, _stack=None):
         """ Signal that something has changed in this object
 
             Raises a ValueError if this object is locked
 
-            Clears the caches on this object, then calls 'mutate' on anything
-            returned by self.mutates_with_this()
+            Clears the caches on this object (or gives it a new version if it
+            uses versioned caches), then calls 'mutate' on anything returned by
+            self.mutates_with_this()
         """
         if not hasattr(self, "_memo_init"):
             return
@@ -90,10 +256,69 @@ class MemoClass(object):
             # avoid infinite recursion
             return
         _stack.add(id(self) )
-        self.clear_caches()
+        if self.versioned_caches:
+            self._memo_version = _new_version()
+        else:
+            self.clear_caches()
         for obj in self.mutates_with_this():
             obj.mutate(_stack)
 
+    def _pickled_memomethods(self):
+        """ List the memomethods whose caches should be pickled """
+        if self.pickle_caches is True:
+            return self._memomethods()
+        elif not self.pickle_caches:
+            return set()
+        elif callable(self.pickle_caches):
+            return set(m for m in self._memomethods() if self.pickle_caches(m) )
+        else:
+            return self._memomethods() & set(self.pickle_caches)
+
+    def __getstate__(self):
+        """ Get the state for pickling, including any requested caches """
+        state = self.__dict__.copy()
+        state.pop("_memo_stamp", None)
+        caches = {}
+        for m in self._pickled_memomethods():
+            cache = getattr(type(self), m).get_cache(self)
+            if cache is None:
+                continue
+            if hasattr(cache, "snapshot"):
+                # Versioned caches: the stamps are not meaningful outside of
+                # this object
+                entries = cache.snapshot()
+            else:
+                # Store a plain dictionary of the entries, so that a shallow
+                # copy of this object doesn't share any part of its cache with
+                # the original
+                entries = dict(cache.items() )
+            if entries:
+                caches[m] = entries
+        if caches:
+            state["_memo_caches"] = caches
+        return state
+
+    def __setstate__(self, state):
+        """ Restore the state when unpickling, reattaching any caches """
+        state = dict(state)
+        caches = state.pop("_memo_caches", {})
+        # Go through __dict__ to bypass __setattr__
+        self.__dict__.update(state)
+        if "_memo_version" in state:
+            # Version numbers are only unique within a process
+            self.__dict__["_memo_version"] = _new_version()
+        for m, entries in caches.items():
+            method = getattr(type(self), m)
+            # Rebuild the cache with the type used by the memomethod
+            cache = method._new_cache(self)
+            if hasattr(cache, "restore"):
+                # The objects that this depends on may not be restored yet, so
+                # the entries can't be stamped now
+                cache.restore(entries)
+            else:
+                cache.update(entries)
+            method.set_cache(self, cache)
+
     def enable_caches(self, clsmethods=False):
         """ Enable the cache on all memomethods """
         if not hasattr(self, "_memo_init"):
@@ -125,18 +350,39 @@ class MemoClass(object):
         else:
             return self._locked
 
-    def lock(self):
+    def lock(self, precompute=(), executor=None):
         """ Lock the class
         
             A locked class' caches are always enabled and calling a mutating
             method on it results in a ValueError
+
+            :param precompute:
+                Memomethod calls whose results should be calculated straight
+                away, see the precompute function
+            :param executor:
+                If not None, the executor on which to make the precompute calls
         """
         if not hasattr(self, "_memo_init"):
             raise ValueError(
                     "Cannot lock MemoClass before MemoClass.__init__" +
                     "is finished!")
+        was_locked = self._locked
         self.enable_caches()
         self._locked = True
+        if precompute:
+            try:
+                self.precompute(precompute, executor)
+            except BaseException:
+                # Don't leave the object locked if it wasn't before
+                self._locked = was_locked
+                raise
+
+    def precompute(self, calls, executor=None):
+        """ Lock this object and fill the caches of some of its memomethods
+
+            See the precompute function for the meaning of the arguments
+        """
+        precompute((self,), calls, executor)
 
     def unlock(self, clear_caches):
         """ Unlock the class
@@ -154,15 +400,21 @@ class MemoClass(object):
             self.clear_caches()
 
     @contextmanager
-    def locked(self, clear_on_unlock=None):
+    def locked(self, clear_on_unlock=None, precompute=(), executor=None):
         """ A context manager that temporarily locks the class
 
-            Does nothing if the class is already locked
+            Does nothing if the class is already locked, except for any
+            precompute calls
     
             :param clear_on_unlock:
                 If True, disable the class' caches and clear them when
                 unlocking. The caches will only be cleared if the class was
                 unlocked before calling locked
+            :param precompute:
+                Memomethod calls whose results should be calculated straight
+                away, see the precompute function
+            :param executor:
+                If not None, the executor on which to make the precompute calls
         """
         if not hasattr(self, "_memo_init"):
             raise ValueError(
@@ -173,11 +425,17 @@ class MemoClass(object):
             # before
             clear_on_unlock = not self._caches_enabled
         if self.is_locked:
+            if precompute:
+                self.precompute(precompute, executor)
             yield
         else:
             self.lock()
-            yield
-            self.unlock(clear_on_unlock)
+            try:
+                if precompute:
+                    self.precompute(precompute, executor)
+                yield
+            finally:
+                self.unlock(clear_on_unlock)
 
     @contextmanager
     def unlocked(self, clear_caches=True):
@@ -194,8 +452,10 @@ class MemoClass(object):
                     "is finished!")
         if self.is_locked:
             self.unlock(clear_caches)
-            yield
-            self.lock()
+            try:
+                yield
+            finally:
+                self.lock()
         else:
             yield
 
@@ -1,19 +1,17 @@
 """ Basic decoarators for memoizing functions and methods"""
 
-from builtins import object
+import sys
 from functools import update_wrapper, partial
-from inspect import getcallargs, isfunction, ismethod
+from itertools import islice
+from collections import deque
 from types import MethodType
-from future.utils import iteritems, itervalues, PY3
-if PY3:
-    from collections.abc import MutableMapping
-    from inspect import getfullargspec as getargspec
-    from inspect import signature, Signature, Parameter
-else:
-    from collections import MutableMapping
-    from inspect import getargspec
-    from funcsigs import signature, Signature, Parameter
 import weakref
+if sys.version_info[0] >= 3:
+    from time import perf_counter as default_timer
+else:
+    from builtins import object
+    from timeit import default_timer
+from .manager import cache_manager
 
 def _to_hashable(arg=None):
     """ Convert an argument into a hashable type
@@ -37,7 +35,7 @@ def _to_hashable(arg=None):
     elif isinstance(arg, (tuple, list) ):
         return tuple(_to_hashable(element) for element in arg)
     elif isinstance(arg, dict):
-        return frozenset((k, _to_hashable(v)) for k, v in iteritems(arg) )
+        return frozenset((k, _to_hashable(v)) for k, v in arg.items() )
     else:
         return arg
 
@@ -60,19 +58,19 @@ def bind_callargs(sig, *args, **kwargs):
     bound = sig.bind(*args, **kwargs).arguments
     params = sig.parameters
     callargs = {}
-    for name, parameter in iteritems(params):
+    for name, parameter in params.items():
         try:
             # Get the paramter value from the bound arguments
             callargs[name] = bound[name]
         except KeyError:
             # Have to get the 'default' value
-            if parameter.default is not Signature.empty:
+            if parameter.default is not parameter.empty:
                 # There *is* a default!
                 callargs[name] = parameter.default
-            elif parameter.kind == Parameter.VAR_POSITIONAL:
+            elif parameter.kind == parameter.VAR_POSITIONAL:
                 # The default for varargs is an empty tuple
                 callargs[name] = ()
-            elif parameter.kind == Parameter.VAR_KEYWORD:
+            elif parameter.kind == parameter.VAR_KEYWORD:
                 # The default for varkwargs is an empty dict
                 callargs[name] = {}
             else:
@@ -83,6 +81,98 @@ def bind_callargs(sig, *args, **kwargs):
                         "Cannot find default value for parameter " + name)
     return callargs
 
+#: Key policy: the argument is converted using the prehash function
+STRUCTURE = "structure"
+#: Key policy: the argument is compared by identity and any cache entries using
+#: it are removed when it is garbage collected
+IDENTITY = "identity"
+#: Key policy: the argument is not included in the key
+IGNORE = "ignore"
+
+class _IdentityKey(object):
+    """ Key component representing an argument by its identity
+
+        If possible, a weak reference to the argument is held and when the
+        argument is deleted, all cache entries using this key are removed. If
+        the argument does not support weak references a strong reference is
+        held instead, so that its id cannot be reused.
+    """
+    __slots__ = ("_id", "_ref", "_watchers")
+
+    def __init__(self, obj):
+        self._id = id(obj)
+        watchers = self._watchers = []
+        def _on_delete(r):
+            for cache, key in watchers:
+                cache.pop(key, None)
+        try:
+            self._ref = weakref.ref(obj, _on_delete)
+        except TypeError:
+            self._ref = obj
+
+    def watch(self, cache, key):
+        """ Remove key from cache when the argument is deleted """
+        self._watchers.append((cache, key) )
+
+    def _to_hashable(self):
+        return self
+
+    def __hash__(self):
+        return hash(self._id)
+
+    def __eq__(self, other):
+        return isinstance(other, _IdentityKey) and self._id == other._id
+
+    def __ne__(self, other):
+        return not self == other
+
+def _apply_key_policy(key_policy, callargs):
+    """ Apply per-parameter key policies to a callargs dictionary
+
+        The dictionary is modified in place. Returns a list of any identity
+        keys created.
+    """
+    idents = []
+    for name, policy in key_policy.items():
+        if policy == STRUCTURE:
+            continue
+        elif policy == IGNORE:
+            del callargs[name]
+        elif policy == IDENTITY:
+            ident = callargs[name] = _IdentityKey(callargs[name])
+            idents.append(ident)
+        else:
+            callargs[name] = policy(callargs[name])
+    return idents
+
+def _get_signature(func):
+    """ Get the signature of a function
+
+        The modules providing this are only imported when first needed, as
+        inspect is relatively slow to import
+    """
+    if sys.version_info[0] >= 3:
+        from inspect import signature
+    else:
+        from funcsigs import signature
+    return signature(func)
+
+class _LazySignature(object):
+    """ Calculates the signature of a MemoFunc on first use
+
+        The signature is then stored on the instance, so later lookups do not
+        go through this descriptor
+    """
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        sig = obj.__dict__["_signature"] = _get_signature(obj.__wrapped__)
+        return sig
+
+def _identity(x):
+    """ The default on_return function """
+    return x
+
 def make_decorator(decorator):
     def inner(func=None, **kwargs):
         if func is None:
@@ -91,10 +181,287 @@ def make_decorator(decorator):
             return decorator(func, **kwargs)
     return inner
 
+class KeyRecorder(object):
+    """ Records the arguments of the most frequently used keys of a memoized
+        function
+
+        For each distinct key only the arguments from its first call and a
+        count are stored. Once the number of distinct keys reaches twice
+        max_size the least frequently used keys are discarded, so the memory
+        used is bounded.
+
+        The recorded trace can be replayed using MemoFunc.warm, for example to
+        fill the caches of a freshly started process.
+    """
+    def __init__(self, max_size=1000):
+        """ Create the recorder
+
+            :param max_size: The number of keys to keep in the trace
+        """
+        self.max_size = max_size
+        self._entries = {}
+
+    def record(self, key, args, kwargs):
+        """ Record a call with the given key and arguments """
+        try:
+            self._entries[key][0] += 1
+        except KeyError:
+            self._entries[key] = [1, args, kwargs]
+            if len(self._entries) >= 2*self.max_size:
+                self._prune()
+
+    def _prune(self):
+        """ Keep only the max_size most frequently used keys """
+        keep = sorted(
+                self._entries.items(), key=lambda kv: kv[1][0],
+                reverse=True)[:self.max_size]
+        self._entries = dict(keep)
+
+    def trace(self, n=None):
+        """ Get the recorded arguments as a list of (args, kwargs) pairs
+
+            The most frequently used keys come first
+
+            :param n: If not None, only return the n most frequently used keys
+        """
+        entries = sorted(
+                self._entries.values(), key=lambda e: e[0], reverse=True)
+        n = self.max_size if n is None else min(n, self.max_size)
+        return [(args, kwargs) for _, args, kwargs in entries[:n]]
+
+    def clear(self):
+        """ Remove all recorded keys """
+        self._entries.clear()
+
+    def __len__(self):
+        return min(len(self._entries), self.max_size)
+
+class ReplayBuffer(object):
+    """ A lazily filled, replayable sequence wrapping an iterator
+
+        Each call to iter creates an independent iterator. Items that have
+        already been produced are read from the buffer, new items are only
+        pulled from the source when a reader gets to the end of the buffer.
+
+        If max_items is set, only that many items are buffered. The first
+        reader to go beyond that takes over the source directly and any later
+        reader that goes beyond it gets a fresh iterator from the factory,
+        skipping the buffered items.
+
+        If the source raises an exception while filling the buffer, the
+        exception is stored and raised to every reader that reaches that
+        point, rather than the sequence appearing to end there. The buffer is
+        then marked as failed, so that memoized functions compute a new one
+        for later calls.
+    """
+    def __init__(self, factory, max_items=None):
+        """ Create the buffer
+
+            :param factory: A callable returning the iterator to buffer
+            :param max_items: The maximum number of items to buffer
+        """
+        self._factory = factory
+        self._source = iter(factory() )
+        self._items = []
+        self._done = False
+        # The exception raised by the source, if any
+        self._error = None
+        self._max_items = max_items
+        import threading
+        self._lock = threading.Lock()
+        if max_items is None:
+            # Never needed again
+            self._factory = None
+
+    @property
+    def failed(self):
+        """ Whether the source raised an exception """
+        return self._error is not None
+
+    def _pull(self, idx):
+        """ Make sure that item idx is in the buffer if possible
+
+            Returns False if the source is exhausted or the buffer is full.
+            Raises the source's exception if it failed before item idx.
+        """
+        with self._lock:
+            while idx >= len(self._items):
+                if self._error is not None:
+                    raise self._error
+                if self._done or self._source is None or (
+                        self._max_items is not None and
+                        idx >= self._max_items):
+                    return False
+                try:
+                    self._items.append(next(self._source) )
+                except StopIteration:
+                    self._done = True
+                    # Release anything held by the source
+                    self._source = None
+                    self._factory = None
+                    return False
+                except Exception as e:
+                    self._error = e
+                    self._source = None
+                    self._factory = None
+                    raise
+            return True
+
+    def __iter__(self):
+        idx = 0
+        while idx < len(self._items) or self._pull(idx):
+            yield self._items[idx]
+            idx += 1
+        if self._done:
+            return
+        # We are past the end of the buffer
+        with self._lock:
+            source, self._source = self._source, None
+        if source is None:
+            # Recompute, skipping over the buffered items
+            source = islice(self._factory(), self._max_items, None)
+        for item in source:
+            yield item
+
+def _weak_cache_cls(weak_values):
+    """ Get the cache type to use for the weak_values argument """
+    from .caches import WeakValueCache
+    if weak_values is True:
+        return WeakValueCache
+    else:
+        return partial(WeakValueCache, ring_size=weak_values)
+
+def _compact_cache(cache, verify_keys):
+    """ Wrap a cache so that it stores digests of its keys """
+    from .caches import CompactKeyCache
+    return CompactKeyCache(cache, verify_keys)
+
+def _compact_cache_cls(cache_cls, verify_keys):
+    """ Get the cache type to use for the compact_keys argument """
+    def make_cache():
+        return _compact_cache(cache_cls(), verify_keys)
+    return make_cache
+
+def _check_compact(weak_values, compact_keys, verify_keys):
+    if weak_values and compact_keys and verify_keys:
+        raise ValueError(
+                "weak_values can only be used with compact_keys if "
+                "verify_keys is False")
+
+class AdaptivePolicy(object):
+    """ Decides whether memoizing a function is worth its cost
+
+        While the cache is enabled, the time spent building keys, the number of
+        hits and misses and the time spent computing the function on a miss
+        are sampled. After each window of calls the time saved by the hits is
+        compared to the time spent building keys and if memoizing costs more
+        than it saves the cache is disabled and cleared. After a further
+        recheck calls the cache is enabled again and sampling restarts.
+
+        The time saved by a hit is estimated from the average compute time of
+        all misses seen so far, not just those in the current window, as a
+        window may contain only hits. No decision is made before the first
+        miss.
+    """
+    def __init__(self, window=1000, recheck=10000, max_decisions=20):
+        """ Create the policy
+
+            :param window: The number of calls to sample before deciding
+            :param recheck:
+                The number of calls to wait before enabling the cache again
+            :param max_decisions: The number of past decisions to remember
+        """
+        self.window = window
+        self.recheck = recheck
+        #: The most recent decisions, as dictionaries
+        self.decisions = deque(maxlen=max_decisions)
+        #: Whether the cache is currently disabled by this policy
+        self.disabled = False
+        #: The number of misses and the time spent on them over all windows
+        self.total_misses = 0
+        self.total_compute_time = 0.
+        self.reset()
+
+    def reset(self):
+        """ Reset the sampled statistics """
+        self.calls = 0
+        self.hits = 0
+        self.misses = 0
+        self.key_time = 0.
+        self.compute_time = 0.
+
+    def add_miss(self, compute_time):
+        """ Record the time spent computing a cache miss """
+        self.misses += 1
+        self.compute_time += compute_time
+        self.total_misses += 1
+        self.total_compute_time += compute_time
+
+    @property
+    def miss_cost(self):
+        """ The average time spent on a miss, or None if there were none """
+        if self.total_misses == 0:
+            return None
+        return self.total_compute_time / self.total_misses
+
+    def should_disable(self):
+        """ Whether the sampled statistics mean that caching should stop """
+        cost = self.miss_cost
+        if cost is None:
+            return False
+        return self.key_time > self.hits * cost
+
+    def record(self, action):
+        """ Record a decision """
+        self.decisions.append({
+            "action" : action,
+            "calls" : self.calls,
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "key_time" : self.key_time,
+            "compute_time" : self.compute_time,
+            "miss_cost" : self.miss_cost})
+
+    def report(self):
+        """ Summarise the current state of the policy """
+        return {
+            "disabled" : self.disabled,
+            "calls" : self.calls,
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "key_time" : self.key_time,
+            "compute_time" : self.compute_time,
+            "miss_cost" : self.miss_cost,
+            "decisions" : list(self.decisions)}
+
+# Sentinel for missing cache entries
+_missing = object()
+
+# Types which _to_hashable returns unchanged, so can be used directly in keys
+_ATOMIC_TYPES = frozenset((int, float, complex, bool, str, bytes, type(u""),
+                           type(None) ) )
+
+class _Deferred(BaseException):
+    """ Raised by a recursive MemoFunc which has gone too deep during
+        MemoFunc.evaluate. This is a BaseException so that it passes through
+        any 'except Exception' blocks in the memoized function.
+    """
+    def __init__(self, func, args, kwargs):
+        super(_Deferred, self).__init__()
+        self.func = func
+        self.call_args = args
+        self.call_kwargs = kwargs
+
 class MemoFunc(object):
     """ Memoizes a free function """
-    def __init__(self, func, cache=None, on_return=lambda x: x,
-                 prehash=_to_hashable):
+    # The signature is only calculated when first needed and then cached
+    _signature = _LazySignature()
+
+    def __init__(self, func, cache=None, on_return=_identity,
+                 prehash=_to_hashable, recorder=None, replay=False,
+                 replay_limit=None, weak_values=False, key_policy=None,
+                 adaptive=None, recursive=False, signature=None,
+                 compact_keys=False, verify_keys=True):
         """ Memoize a free function
 
             :param func: The function to memoize
@@ -114,16 +481,146 @@ class MemoFunc(object):
             :param prehash:
                 The function that should be used to make the arguments hashable.
                 It will receive the callargs dictionary as an argument
+            :param recorder:
+                A KeyRecorder used to record the arguments of calls made while
+                the cache is enabled. If True, a new KeyRecorder is created.
+            :param replay:
+                If True, the function returns an iterator (for example it is a
+                generator function). The cached value is a ReplayBuffer and
+                each call receives a new, independent iterator over it.
+            :param replay_limit:
+                If replay is used, the maximum number of items to buffer for
+                each result. Readers going past this recompute the result.
+            :param weak_values:
+                If True and no cache is provided, use a WeakValueCache so that
+                results can be reclaimed once they are no longer used. If an
+                integer, the number of recently used results to keep alive.
+            :param key_policy:
+                A dictionary mapping parameter names to how they should be
+                treated when building the key. The policy can be STRUCTURE
+                (the default, use the prehash function), IDENTITY (compare by
+                identity and remove entries when the argument is deleted),
+                IGNORE (leave the argument out of the key) or a function
+                returning the key to use for that argument.
+            :param adaptive:
+                An AdaptivePolicy used to switch the cache off when memoizing
+                costs more time than it saves. If True, a new AdaptivePolicy
+                with the default settings is created. Note that this has no
+                effect on memomethods as a new MemoFunc is created each time
+                the method is accessed.
+            :param recursive:
+                If True, optimise for a function which calls itself. Calls
+                made only with positional arguments of simple types (numbers,
+                strings, bytes and None) use the arguments tuple directly as
+                the key, skipping binding and hashing. This mode also allows
+                using evaluate for recursions that are too deep for the
+                interpreter. It can't be combined with a custom prehash
+                function, key policy or adaptive policy.
+            :param signature:
+                The signature of func, if it is already known. Otherwise it is
+                calculated when first needed.
+            :param compact_keys:
+                If True and no cache is provided, wrap the cache in a
+                CompactKeyCache so that it stores fixed size digests of the
+                keys. With verify_keys the full keys are still kept, so this
+                only saves memory when large arguments are repeated between
+                calls.
+            :param verify_keys:
+                If compact_keys is used, whether to keep the keys to check
+                against on each hit. If False only the digests are kept, which
+                saves the most memory, see CompactKeyCache.
         """
         update_wrapper(self, func)
         # Set the __wrapped__ attribute to play nicely with signature
         self.__wrapped__ = func
-        # Cache the signature here, rather than recalculating it every call
-        self._signature = signature(func)
-        self._cache = {} if cache is None else cache
+        if signature is not None:
+            self._signature = signature
+        if cache is None:
+            _check_compact(weak_values, compact_keys, verify_keys)
+            cache = _weak_cache_cls(weak_values)() if weak_values else {}
+            if compact_keys:
+                cache = _compact_cache(cache, verify_keys)
+        self._cache = cache
         self._on_return = on_return
         self._prehash = prehash
         self._cache_enabled = True
+        self.recorder = KeyRecorder() if recorder is True else recorder
+        self._replay = replay
+        self._replay_limit = replay_limit
+        if key_policy:
+            for name in key_policy:
+                if name not in self._signature.parameters:
+                    raise ValueError(
+                            "Key policy given for unknown parameter " + name)
+        else:
+            key_policy = None
+        self._key_policy = key_policy
+        self.adaptive = AdaptivePolicy() if adaptive is True else adaptive
+        if recursive and (prehash is not _to_hashable or key_policy):
+            raise ValueError(
+                    "recursive cannot be used with prehash or key_policy")
+        if recursive and self.adaptive is not None:
+            raise ValueError("recursive cannot be used with adaptive")
+        self._recursive = recursive
+        # The positional parameter names used to build keys in recursive mode
+        self._key_names = _missing
+        # The current recursion depth, and the depth at which evaluate defers
+        self._depth = 0
+        self._depth_limit = None
+        # If set, a dictionary and key in which to register this while it is
+        # running, so that recursive method calls can retrieve it directly
+        self._reentry = None
+        if not isinstance(func, MethodType):
+            # Bound functions share their caches with their MemoMethod
+            cache_manager.register(self)
+
+    def _memo_caches(self):
+        """ The caches owned by this object, used by the cache manager """
+        return (self._cache,)
+
+    def _make_key(self, args, kwargs):
+        """ Build the cache key corresponding to a set of arguments """
+        if self._recursive:
+            return self._positional_key(args, kwargs)
+        callargs = bind_callargs(self._signature, *args, **kwargs)
+        if self._key_policy is None:
+            return self._prehash(callargs)
+        idents = _apply_key_policy(self._key_policy, callargs)
+        key = self._prehash(callargs)
+        for ident in idents:
+            ident.watch(self._cache, key)
+        return key
+
+    def _positional_key(self, args, kwargs):
+        """ Build the key used in recursive mode
+
+            If all parameters are positional, the key is the tuple of the
+            hashable forms of the arguments in order, which for simple types is
+            just the arguments tuple itself.
+        """
+        names = self._key_names
+        if names is _missing:
+            names = self._key_names = self._get_key_names()
+        if names is None:
+            return self._prehash(
+                    bind_callargs(self._signature, *args, **kwargs) )
+        if not kwargs and len(args) == len(names):
+            for arg in args:
+                if type(arg) not in _ATOMIC_TYPES:
+                    break
+            else:
+                return args
+        callargs = bind_callargs(self._signature, *args, **kwargs)
+        return tuple(_to_hashable(callargs[name]) for name in names)
+
+    def _get_key_names(self):
+        """ Get the parameter names if they can all be passed positionally """
+        params = list(self._signature.parameters.values() )
+        for param in params:
+            if param.kind not in (
+                    param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+                return None
+        return tuple(param.name for param in params)
 
     def clear_cache(self):
         """ Clear the cache """
@@ -132,29 +629,211 @@ class MemoFunc(object):
     def rm_from_cache(self, *args, **kwargs):
         """ Remove the corresponding value from the cache """
         try:
-            del self._cache[self._prehash(
-                bind_callargs(self._signature, *args, **kwargs) )]
+            del self._cache[self._make_key(args, kwargs)]
         except KeyError:
             pass
 
+    def add_to_cache(self, value, args=(), kwargs=None):
+        """ Store a value in the cache as the result for a set of arguments
+
+            :param value: The value to store
+            :param args: The positional arguments
+            :param kwargs: The keyword arguments
+        """
+        if kwargs is None:
+            kwargs = {}
+        self._cache[self._make_key(args, kwargs)] = value
+
+    def evaluate(self, args=(), kwargs=None, max_depth=None):
+        """ Call a recursive function without hitting the recursion limit
+
+            Whenever the recursion gets deeper than max_depth, the innermost
+            call is abandoned and evaluated on its own first, after which the
+            outer calls are retried. As the results of the inner calls are in
+            the cache the retries are cheap. This only works correctly if the
+            function has no side effects other than its recursive calls.
+
+            Requires recursive to be set.
+
+            :param args: The positional arguments
+            :param kwargs: The keyword arguments
+            :param max_depth:
+                The maximum recursion depth, by default a tenth of the
+                interpreter's recursion limit
+        """
+        if not self._recursive:
+            raise ValueError("evaluate requires recursive to be set")
+        if kwargs is None:
+            kwargs = {}
+        if max_depth is None:
+            max_depth = max(sys.getrecursionlimit() // 10, 1)
+        stack = [(args, kwargs)]
+        self._depth_limit = max_depth
+        try:
+            while stack:
+                try:
+                    value = self(*stack[-1][0], **stack[-1][1])
+                except _Deferred as e:
+                    if e.func is not self:
+                        raise
+                    stack.append((e.call_args, e.call_kwargs) )
+                else:
+                    stack.pop()
+        finally:
+            self._depth_limit = None
+        return value
+
+    def warm(self, trace, executor=None):
+        """ Fill the cache by calling the function with recorded arguments
+
+            :param trace:
+                An iterable of (args, kwargs) pairs, for example as returned by
+                KeyRecorder.trace
+            :param executor:
+                If not None, a concurrent.futures.Executor used to make the
+                calls in parallel. Note that a process pool cannot be used as
+                the results must end up in this process' cache.
+            :return: The number of calls made
+        """
+        if executor is None:
+            n = 0
+            for args, kwargs in trace:
+                self(*args, **kwargs)
+                n += 1
+            return n
+        futures = [executor.submit(self, *args, **kwargs)
+                   for args, kwargs in trace]
+        for future in futures:
+            future.result()
+        return len(futures)
+
     @property
     def cache_enabled(self):
         return self._cache_enabled
 
     def enable_cache(self):
         self._cache_enabled = True
+        if self.adaptive is not None:
+            self.adaptive.disabled = False
+            self.adaptive.reset()
 
     def disable_cache(self):
         self._cache_enabled = False
+        if self.adaptive is not None:
+            # Explicitly disabled, so the policy shouldn't reenable it
+            self.adaptive.disabled = False
 
     def __call__(self, *args, **kwargs):
-        """ Call the actual function """
+        """ Call the actual function
+
+            Unless replaying, the function is called directly from here rather
+            than through another method, so that each level of a recursive
+            function only adds one frame to the stack
+        """
+        if self._recursive:
+            if not self._cache_enabled:
+                return self.__wrapped__(*args, **kwargs)
+            key = self._positional_key(args, kwargs)
+            if self.recorder is not None:
+                self.recorder.record(key, args, kwargs)
+            value = self._cache.get(key, _missing)
+            if value is not _missing and self._replay and value.failed:
+                value = _missing
+            if value is _missing:
+                if self._depth_limit is not None and \
+                        self._depth >= self._depth_limit:
+                    raise _Deferred(self, args, kwargs)
+                self._depth += 1
+                if self._depth == 1 and self._reentry is not None:
+                    self._reentry[0][self._reentry[1]] = self
+                try:
+                    if self._replay:
+                        value = self._compute(args, kwargs)
+                    else:
+                        value = self.__wrapped__(*args, **kwargs)
+                    self._cache[key] = value
+                finally:
+                    self._depth -= 1
+                    if self._depth == 0 and self._reentry is not None:
+                        self._reentry[0].pop(self._reentry[1], None)
+            if self._replay or self._on_return is not _identity:
+                return self._returned(value)
+            return value
+        if self.adaptive is not None:
+            return self._adaptive_call(args, kwargs)
         if not self.cache_enabled:
             return self.__wrapped__(*args, **kwargs)
-        key = self._prehash(bind_callargs(self._signature, *args, **kwargs) )
-        if key not in self._cache:
-            self._cache[key] = self.__wrapped__(*args, **kwargs)
-        return self._on_return(self._cache[key])
+        key = self._make_key(args, kwargs)
+        if self.recorder is not None:
+            self.recorder.record(key, args, kwargs)
+        value = self._cache.get(key, _missing)
+        if value is not _missing and self._replay and value.failed:
+            value = _missing
+        if value is _missing:
+            if self._replay:
+                value = self._compute(args, kwargs)
+            else:
+                value = self.__wrapped__(*args, **kwargs)
+            self._cache[key] = value
+        return self._returned(value)
+
+    def _returned(self, value):
+        """ Convert a cached value into the value to return """
+        if self._replay:
+            value = iter(value)
+        return self._on_return(value)
+
+    def _adaptive_call(self, args, kwargs):
+        """ Call the function, sampling the statistics for the policy """
+        policy = self.adaptive
+        if not self.cache_enabled:
+            if policy.disabled:
+                policy.calls += 1
+                if policy.calls >= policy.recheck:
+                    policy.record("enable")
+                    policy.disabled = False
+                    policy.reset()
+                    self._cache_enabled = True
+            return self.__wrapped__(*args, **kwargs)
+        start = default_timer()
+        key = self._make_key(args, kwargs)
+        if self.recorder is not None:
+            self.recorder.record(key, args, kwargs)
+        keyed = default_timer()
+        value = self._cache.get(key, _missing)
+        if value is not _missing and self._replay and value.failed:
+            value = _missing
+        if value is _missing:
+            if self._replay:
+                value = self._compute(args, kwargs)
+            else:
+                value = self.__wrapped__(*args, **kwargs)
+            self._cache[key] = value
+            policy.add_miss(default_timer() - keyed)
+        else:
+            policy.hits += 1
+        policy.key_time += keyed - start
+        policy.calls += 1
+        if policy.calls >= policy.window:
+            if policy.should_disable():
+                policy.record("disable")
+                policy.disabled = True
+                self._cache_enabled = False
+                self._cache.clear()
+            policy.reset()
+        return self._returned(value)
+
+    def _compute(self, args, kwargs):
+        """ Create the replay buffer to store in the cache """
+        func = self.__wrapped__
+        if isinstance(func, MethodType):
+            # Don't let the factory keep the bound object alive
+            obj_ref = weakref.ref(func.__self__)
+            unbound = func.__func__
+            factory = lambda: unbound(obj_ref(), *args, **kwargs)
+        else:
+            factory = lambda: func(*args, **kwargs)
+        return ReplayBuffer(factory, self._replay_limit)
 
 memofunc = make_decorator(MemoFunc)
 
@@ -173,14 +852,100 @@ class LockMemoFunc(MemoFunc):
 
     def __call__(self, *args, **kwargs):
         """ Call the function """
+        if self._depth:
+            # Recursive call, the object is already locked by the outer call
+            return super(LockMemoFunc, self).__call__(*args, **kwargs)
         with self.__wrapped__.__self__.locked(self._clear_on_unlock):
             return super(LockMemoFunc, self).__call__(*args, **kwargs)
 
+class FrozenMemoFunc(MemoFunc):
+    """ Used to memoize a bound function on a locked object
+
+        While an object is locked, accessing a memomethod on it returns the
+        same FrozenMemoFunc each time rather than creating a new LockMemoFunc.
+        As the object is already locked, calls do not need to lock it, and the
+        keys built for calls made with only positional arguments of simple
+        types are remembered, so repeated calls go straight to the cache lookup.
+
+        Only a weak reference to the object is held, so that the MemoMethod can
+        keep this without keeping the object alive. It is therefore only handed
+        out through a _FrozenBound, which shares its state and holds the
+        object.
+
+        As a locked object's caches are always enabled, disable_cache has no
+        effect.
+    """
+    #: The maximum number of keys to remember
+    max_keys = 1024
+
+    def __init__(self, func, generation, **kwargs):
+        """ Initialise the bound function
+
+            :param generation: The generation of the MemoMethod's caches
+        """
+        super(FrozenMemoFunc, self).__init__(func, **kwargs)
+        self.generation = generation
+        self._keys = {}
+
+    @property
+    def __wrapped__(self):
+        return MethodType(self._unbound, self._obj_ref() )
+
+    @__wrapped__.setter
+    def __wrapped__(self, func):
+        self._unbound = func.__func__
+        self._obj_ref = weakref.ref(func.__self__)
+
+    def _make_key(self, args, kwargs):
+        """ Build the cache key, reusing it if the arguments were seen before
+        """
+        if kwargs or self._recursive or self._key_policy is not None:
+            return super(FrozenMemoFunc, self)._make_key(args, kwargs)
+        try:
+            return self._keys[args]
+        except (KeyError, TypeError):
+            pass
+        key = super(FrozenMemoFunc, self)._make_key(args, kwargs)
+        for arg in args:
+            if type(arg) not in _ATOMIC_TYPES:
+                break
+        else:
+            if len(self._keys) >= self.max_keys:
+                self._keys.clear()
+            self._keys[args] = key
+        return key
+
+    def disable_cache(self):
+        """ Does nothing, as the caches of a locked object are always enabled
+        """
+        pass
+
+class _FrozenBound(FrozenMemoFunc):
+    """ The bound function returned for a locked object
+
+        This shares the attribute dictionary of the FrozenMemoFunc kept by the
+        MemoMethod, so it behaves exactly like it, but also holds a strong
+        reference to the object so that the object stays alive for as long as
+        the function does.
+    """
+    __slots__ = ("_obj",)
+
+    @classmethod
+    def bind(cls, frozen, obj):
+        """ Create the bound function, without reinitialising frozen """
+        bound = cls.__new__(cls)
+        bound.__dict__ = frozen.__dict__
+        bound._obj = obj
+        return bound
+
 class MemoMethod(object):
     """ Memoizes a class' method """
 
-    def __init__(self, func, cache_cls=dict, on_return=lambda x: x,
-                 prehash=_to_hashable, locks=True, clear_on_unlock=None):
+    def __init__(self, func, cache_cls=dict, on_return=_identity,
+                 prehash=_to_hashable, locks=True, clear_on_unlock=None,
+                 recorder=None, replay=False, replay_limit=None,
+                 weak_values=False, key_policy=None, recursive=False,
+                 compact_keys=False, verify_keys=True):
         """ Memoize a bound method
 
             As 'locks' defaults to True, if a class has a 'locked' function
@@ -205,32 +970,103 @@ class MemoMethod(object):
                 use that as a context manager
             :param clear_on_unlock:
                 If locks is used, the argument to the 'locked' function
+            :param recorder:
+                A KeyRecorder used to record the arguments of calls on all
+                bound objects. If True, a new KeyRecorder is created.
+            :param replay:
+                If True, the method returns an iterator which should be cached
+                as a replayable sequence, see MemoFunc
+            :param replay_limit:
+                If replay is used, the maximum number of items to buffer
+            :param weak_values:
+                If True, use a WeakValueCache for each bound object. If an
+                integer, the number of recently used results to keep alive.
+                Cannot be used together with cache_cls
+            :param key_policy:
+                A dictionary mapping parameter names to how they should be
+                treated when building the key, see MemoFunc
+            :param recursive:
+                If True, optimise for a method which calls itself, see
+                MemoFunc. While a call is running, recursive calls on the same
+                object reuse its bound function rather than creating a new one.
+            :param compact_keys:
+                If True, wrap each object's cache in a CompactKeyCache, see
+                MemoFunc
+            :param verify_keys:
+                If compact_keys is used, whether to keep the keys to check
+                against on each hit
         """
         self.__wrapped__ = func
+        if weak_values:
+            if cache_cls is not dict:
+                raise ValueError(
+                        "Cannot use both weak_values and cache_cls")
+            cache_cls = _weak_cache_cls(weak_values)
+        _check_compact(weak_values, compact_keys, verify_keys)
+        if compact_keys:
+            cache_cls = _compact_cache_cls(cache_cls, verify_keys)
         self._cache_cls = cache_cls
         self._on_return = on_return
         self._prehash = prehash
         self._bound_caches = {}
-        self._weakrefs = []
+        # Also used as a queue by sweep, which rotates through it
+        self._weakrefs = deque()
+        # The generation of each bound cache. If this is older than the
+        # method's generation, the cache is stale
+        self._generation = 0
+        self._cache_generations = {}
+        # The number of caches at the front of the queue which sweep has not
+        # checked since the last invalidation
+        self._unswept = 0
         self._locks = locks
         self._clear_on_unlock = clear_on_unlock
+        self.recorder = KeyRecorder() if recorder is True else recorder
+        self._replay = replay
+        self._replay_limit = replay_limit
+        self._key_policy = key_policy
+        self._recursive = recursive
+        # Bound functions of recursive methods which are currently running
+        self._active = {}
+        # The bound functions of locked objects
+        self._frozen = {}
+        cache_manager.register(self)
+
+    @property
+    def _bound_signature(self):
+        """ The signature of the method once bound to an object
+
+            This is calculated once here rather than for each bound function
+        """
+        sig = self.__dict__.get("_bound_sig")
+        if sig is None:
+            sig = _get_signature(self.__wrapped__)
+            params = list(sig.parameters.values() )
+            if params and params[0].kind != params[0].VAR_POSITIONAL:
+                params = params[1:]
+            sig = self._bound_sig = sig.replace(parameters=params)
+        return sig
+
+    def _memo_caches(self):
+        """ The caches owned by this object, used by the cache manager """
+        return list(self._bound_caches.values() )
 
     def __get__(self, obj, objtype=None):
         if obj is None:
             # Retrieving from the class itself, therefore return the method
             # memoizer
             return self
-        obj_id = id(obj)
-        if obj_id not in self._bound_caches:
-            # Create a new cache
-            cache = self._cache_cls()
-            self._bound_caches[obj_id] = cache
-            def _on_delete(r):
-                self._weakrefs.remove(r)
-                del self._bound_caches[obj_id]
-            self._weakrefs.append(weakref.ref(obj, _on_delete) )
-        else:
-            cache = self._bound_caches[obj_id]
+        if self._frozen:
+            frozen = self._frozen.get(id(obj) )
+            if frozen is not None:
+                if frozen.generation == self._generation and obj.is_locked:
+                    return _FrozenBound.bind(frozen, obj)
+                # The object was unlocked or its cache invalidated
+                self._frozen.pop(id(obj), None)
+        if self._active:
+            active = self._active.get(id(obj) )
+            if active is not None:
+                return active
+        cache = self._get_cache(obj)
         func = MethodType(self.__wrapped__, obj)
         kwargs = {
                 # Use python's internal function binding
@@ -238,12 +1074,103 @@ class MemoMethod(object):
                 'func' : func,
                 'cache' : cache,
                 'on_return' : self._on_return,
-                'prehash' : self._prehash}
+                'prehash' : self._prehash,
+                'recorder' : self.recorder,
+                'replay' : self._replay,
+                'replay_limit' : self._replay_limit,
+                'key_policy' : self._key_policy,
+                'recursive' : self._recursive,
+                # Skip recalculating the signature
+                'signature' : self._bound_signature}
         # Pick the right type to use (i.e. use a LockMemoFunc if we should)
+        frozen = False
         if self._locks and hasattr(obj, 'locked') and callable(obj.locked):
-            return LockMemoFunc(clear_on_unlock=self._clear_on_unlock, **kwargs)
+            if getattr(obj, 'is_locked', False) is True:
+                # Reuse this until the object is unlocked
+                bound = self._frozen[id(obj)] = FrozenMemoFunc(
+                        generation=self._generation, **kwargs)
+                frozen = True
+            else:
+                bound = LockMemoFunc(
+                        clear_on_unlock=self._clear_on_unlock, **kwargs)
         else:
-            return MemoFunc(**kwargs)
+            bound = MemoFunc(**kwargs)
+        if self._recursive:
+            bound._reentry = (self._active, id(obj) )
+        if frozen:
+            return _FrozenBound.bind(bound, obj)
+        return bound
+
+    def _get_cache(self, obj):
+        """ Get the cache for an object, creating it if necessary
+
+            If the cache is stale it is cleared before being returned
+        """
+        obj_id = id(obj)
+        cache = self._bound_caches.get(obj_id)
+        if cache is None:
+            # Create a new cache
+            cache = self._new_cache(obj)
+            self._attach_cache(obj, cache)
+        elif self._cache_generations[obj_id] != self._generation:
+            cache.clear()
+            self._cache_generations[obj_id] = self._generation
+        return cache
+
+    def _new_cache(self, obj):
+        """ Create an empty cache for an object
+
+            If the object uses versioned caches (see MemoClass) the cache is
+            wrapped in a VersionedCache
+        """
+        cache = self._cache_cls()
+        if getattr(obj, "versioned_caches", False) and \
+                not isinstance(obj, type):
+            from .caches import VersionedCache
+            cache = VersionedCache(obj, cache)
+        return cache
+
+    def _attach_cache(self, obj, cache):
+        """ Store a cache for an object, removing it when the object is deleted
+        """
+        obj_id = id(obj)
+        self._bound_caches[obj_id] = cache
+        self._cache_generations[obj_id] = self._generation
+        def _on_delete(r):
+            self._weakrefs.remove(r)
+            del self._bound_caches[obj_id]
+            del self._cache_generations[obj_id]
+            self._frozen.pop(obj_id, None)
+        self._weakrefs.append(weakref.ref(obj, _on_delete) )
+
+    def get_cache(self, bound):
+        """ Get the cache corresponding to an object
+
+            Returns None if no cache exists for this object
+        """
+        if id(bound) not in self._bound_caches:
+            return None
+        return self._get_cache(bound)
+
+    def set_cache(self, bound, cache):
+        """ Set the cache corresponding to an object
+
+            This is mainly intended for restoring caches that were saved using
+            get_cache, for example when unpickling an object. Any existing
+            cache for this object is replaced.
+        """
+        if getattr(bound, "versioned_caches", False) and \
+                not hasattr(cache, "snapshot"):
+            # Stamp the restored entries with the object's current version
+            new_cache = self._new_cache(bound)
+            new_cache.update(cache)
+            cache = new_cache
+        self._frozen.pop(id(bound), None)
+        if id(bound) in self._bound_caches:
+            self._bound_caches[id(bound)] = cache
+            self._cache_generations[id(bound)] = self._generation
+        else:
+            self._attach_cache(bound, cache)
 
     def clear_cache(self, bound=None):
         """ Clear the cache
@@ -253,12 +1180,72 @@ class MemoMethod(object):
                 if bound is None, remove all caches
         """
         if bound is None:
+            # Clear each cache first, in case they hold entries elsewhere
+            for cache in list(self._bound_caches.values() ):
+                cache.clear()
             self._bound_caches.clear()
-            # Python2 doesn't have a list.clear method...
-            del self._weakrefs[:]
+            self._cache_generations.clear()
+            self._frozen.clear()
+            self._weakrefs.clear()
+            self._unswept = 0
         elif id(bound) in self._bound_caches:
             self._bound_caches[id(bound)].clear()
 
+    def invalidate(self):
+        """ Invalidate the caches for all bound objects
+
+            Unlike clear_cache this does not touch any of the caches, it only
+            starts a new generation. Each cache from an older generation is
+            cleared the next time that the method is retrieved from its object,
+            or by sweep.
+        """
+        self._generation += 1
+        self._unswept = len(self._weakrefs)
+
+    def sweep(self, limit=None):
+        """ Clear stale caches left behind by invalidate
+
+            This can be called periodically (for example from a background
+            thread) to release the memory held by stale caches. Each call
+            carries on from where the previous one stopped, so a call only
+            does work proportional to the number of caches it checks.
+
+            :param limit:
+                If not None, the maximum number of caches to check in this call.
+                Caches that were already cleared since the last invalidation
+                count towards this.
+            :return: The number of caches cleared
+        """
+        n = 0
+        count = self._unswept if limit is None else min(limit, self._unswept)
+        for _ in range(count):
+            if not self._weakrefs:
+                break
+            # Move the reference to the back rather than popping it, so that
+            # it can still be removed if its object is deleted
+            r = self._weakrefs[0]
+            self._weakrefs.rotate(-1)
+            self._unswept -= 1
+            obj = r()
+            if obj is None:
+                continue
+            obj_id = id(obj)
+            if self._cache_generations.get(obj_id) == self._generation:
+                continue
+            cache = self._bound_caches.get(obj_id)
+            if cache is not None:
+                cache.clear()
+                self._cache_generations[obj_id] = self._generation
+                n += 1
+        return n
+
+    def warm(self, bound, trace, executor=None):
+        """ Fill the cache for an object by calling with recorded arguments
+
+            See MemoFunc.warm for the meaning of the arguments
+        """
+        return self.__get__(bound).warm(trace, executor)
+
     def __call__(self, bound, *args, **kwargs):
         return self.__get__(bound)(*args, **kwargs)
 memomethod = make_decorator(MemoMethod)
@@ -274,15 +1261,16 @@ class MemoClsMethod(MemoMethod):
     def __get__(self, obj, objtype=None):
         if objtype is None:
             objtype = type(obj)
-        if id(objtype) not in self._bound_caches:
-            # create a new cache
-            cache = self._cache_cls()
-            self._bound_caches[id(objtype)] = cache
-        else:
-            cache = self._bound_caches[id(objtype)]
+        cache = self._get_cache(objtype)
         return memofunc(
                 func=MethodType(self.__wrapped__, objtype),
                 cache=cache,
                 on_return=self._on_return,
-                prehash=self._prehash)
+                prehash=self._prehash,
+                recorder=self.recorder,
+                replay=self._replay,
+                replay_limit=self._replay_limit,
+                key_policy=self._key_policy,
+                recursive=self._recursive,
+                signature=self._bound_signature)
 memoclsmethod = make_decorator(MemoClsMethod)
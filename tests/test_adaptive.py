@@ -0,0 +1,81 @@
+""" Tests for adaptive memoization """
+
+from memoclass.memoize import memofunc, AdaptivePolicy
+import time
+import pytest
+
+@memofunc(adaptive=AdaptivePolicy(window=10, recheck=5) )
+def cheap(x):
+    return x
+
+call_count = 0
+@memofunc(adaptive=AdaptivePolicy(window=10, recheck=5) )
+def expensive(x):
+    global call_count
+    call_count += 1
+    time.sleep(0.001)
+    return x
+
+def test_disable():
+    """ Make sure that an unprofitable cache is switched off and on again """
+    cheap.enable_cache()
+    cheap.clear_cache()
+    for x in range(10):
+        cheap(x)
+    assert not cheap.cache_enabled
+    assert len(cheap._cache) == 0
+    report = cheap.adaptive.report()
+    assert report["disabled"]
+    assert report["decisions"][-1]["action"] == "disable"
+    assert report["decisions"][-1]["hits"] == 0
+    for x in range(5):
+        cheap(x)
+    assert cheap.cache_enabled
+    assert cheap.adaptive.decisions[-1]["action"] == "enable"
+
+def test_keep():
+    """ Make sure that a profitable cache is kept """
+    global call_count
+    call_count = 0
+    expensive.enable_cache()
+    expensive.clear_cache()
+    for _ in range(5):
+        for x in range(3):
+            expensive(x)
+    assert expensive.cache_enabled
+    assert call_count == 3
+    assert len(expensive.adaptive.decisions) == 0
+
+@memofunc(adaptive=AdaptivePolicy(window=10, recheck=5) )
+def repeated(x):
+    global call_count
+    call_count += 1
+    time.sleep(0.001)
+    return x
+
+def test_only_hits():
+    """ Make sure that windows with only hits keep the cache """
+    global call_count
+    call_count = 0
+    repeated.enable_cache()
+    repeated.clear_cache()
+    for _ in range(50):
+        repeated(1)
+    assert repeated.cache_enabled
+    assert call_count == 1
+    assert len(repeated.adaptive.decisions) == 0
+    assert repeated.adaptive.total_misses == 1
+
+def test_explicit_disable():
+    """ Make sure that the policy doesn't override an explicit disable """
+    cheap.disable_cache()
+    for x in range(10):
+        cheap(x)
+    assert not cheap.cache_enabled
+    cheap.enable_cache()
+    assert cheap.cache_enabled
+
+def test_recursive():
+    """ Make sure that adaptive policies can't be used in recursive mode """
+    with pytest.raises(ValueError):
+        memofunc(lambda x: x, recursive=True, adaptive=True)
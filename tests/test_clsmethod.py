@@ -3,7 +3,6 @@
 from builtins import object
 from memoclass.memoize import memoclsmethod
 from inspect import isfunction
-from future.utils import iteritems
 
 call_count = 0
 class Base(object):
@@ -15,7 +14,7 @@ class Base(object):
         global call_count
         call_count += 1
         if not include_base:
-            return set(k for k, v in iteritems(cls.__dict__)
+            return set(k for k, v in cls.__dict__.items()
                        if isfunction(v) )
         else:
             return set().union(*(
@@ -0,0 +1,166 @@
+""" Tests for storing compact keys """
+
+from memoclass.memoize import memofunc, memomethod
+from memoclass.memoclass import MemoClass
+from memoclass.caches import CompactKeyCache, LRUCache, _digest
+from memoclass.manager import _estimate_size, _evict
+import gc
+import pytest
+
+call_count = 0
+@memofunc(compact_keys=True)
+def total(values, weights=None):
+    global call_count
+    call_count += 1
+    if weights is None:
+        return sum(values)
+    return sum(v * weights.get(k, 0) for k, v in enumerate(values) )
+
+@memofunc(compact_keys=True, verify_keys=False)
+def fast_total(values):
+    global call_count
+    call_count += 1
+    return sum(values)
+
+class Matrix(MemoClass):
+    def __init__(self, rows):
+        super(Matrix, self).__init__()
+        self.rows = rows
+
+    @memomethod(compact_keys=True)
+    def dot(self, vector):
+        return [sum(a * b for a, b in zip(row, vector) ) for row in self.rows]
+
+def reset():
+    global call_count
+    call_count = 0
+    total.clear_cache()
+    fast_total.clear_cache()
+
+def test_func():
+    """ Make sure that compact keys cache the same calls as normal keys """
+    reset()
+    values = list(range(100) )
+    assert total(values) == 4950
+    assert total(list(range(100) ) ) == 4950
+    assert total(values, weights={0 : 1}) == 0
+    assert total(values, {0 : 1}) == 0
+    assert call_count == 2
+    total.rm_from_cache(values)
+    total(values)
+    assert call_count == 3
+
+def test_no_verify():
+    """ Make sure that only digests are kept if verification is skipped """
+    reset()
+    assert fast_total([1, 2, 3]) == 6
+    assert fast_total((1, 2, 3) ) == 6
+    assert call_count == 1
+    keys = list(fast_total._cache)
+    assert len(keys) == 1 and len(keys[0]) == 16
+    assert fast_total._cache[keys[0]] == 6
+    del fast_total._cache[keys[0]]
+    assert len(fast_total._cache) == 0
+
+def test_collision(monkeypatch):
+    """ Make sure that colliding digests are caught when verifying """
+    from memoclass import caches
+    monkeypatch.setattr(caches, "_digest", lambda key: b"0"*16)
+    cache = CompactKeyCache()
+    cache[(1, 2)] = "a"
+    assert cache[(1, 2)] == "a"
+    with pytest.raises(KeyError):
+        cache[(2, 1)]
+    cache[(2, 1)] = "b"
+    assert list(cache) == [(2, 1)]
+
+def test_stable():
+    """ Make sure that digests do not depend on order or hash seeds """
+    a = frozenset([("x", (1, 2) ), ("y", "z")])
+    b = frozenset([("y", "z"), ("x", (1, 2) )])
+    assert _digest(a) == _digest(b)
+    assert _digest((1, 2) ) != _digest((2, 1) )
+    assert _digest(("ab", "c") ) != _digest(("a", "bc") )
+    assert _digest(1) != _digest("1")
+
+def test_intern():
+    """ Make sure that repeated parts of keys are only stored once """
+    cache = CompactKeyCache()
+    shared = tuple(range(100) )
+    cache[(shared, 1)] = 1
+    cache[(tuple(range(100) ), 2)] = 2
+    first, second = list(cache)
+    assert first[0] is second[0]
+    del cache[(shared, 1)]
+    assert shared in cache._interned
+    del cache[(shared, 2)]
+    assert not cache._interned
+
+def test_evicting_inner():
+    """ Make sure that keys discarded by the inner mapping are released """
+    cache = CompactKeyCache(LRUCache(10) )
+    for i in range(1000):
+        cache[((i, i + 1), i)] = i
+    assert len(cache) == 10
+    assert len(cache._interned) <= 2 * 10 + 64 + 1
+    for key in cache:
+        assert cache._interned[key[0]][1] == 1
+
+def test_method():
+    """ Make sure that memomethods can use compact keys """
+    m = Matrix([[1, 0], [0, 1]])
+    assert m.dot([2, 3]) == [2, 3]
+    cache = Matrix.dot.get_cache(m)
+    assert isinstance(cache, CompactKeyCache)
+    assert m.dot((2, 3) ) is m.dot([2, 3])
+
+def test_manager():
+    """ Make sure that the cache manager can size and evict entries """
+    cache = CompactKeyCache(LRUCache(10), verify=False)
+    for i in range(10):
+        cache[tuple(range(i*100, (i+1)*100) )] = i
+    assert _estimate_size(cache) < _estimate_size(
+            dict((tuple(range(i*100, (i+1)*100) ), i) for i in range(10) ) )
+    assert _evict(cache, 0.5) == 5
+    assert sorted(cache[key] for key in cache) == [5, 6, 7, 8, 9]
+
+def test_weak_values():
+    """ Make sure that weak values need verification to be switched off """
+    with pytest.raises(ValueError):
+        memofunc(lambda x: x, weak_values=True, compact_keys=True)
+    memofunc(lambda x: x, weak_values=True, compact_keys=True,
+             verify_keys=False)
+
+def cache_memory(values, **kwargs):
+    """ Measure the memory used by caching calls with the given arguments """
+    tracemalloc = pytest.importorskip("tracemalloc")
+    @memofunc(**kwargs)
+    def f(values, i):
+        return i
+    # Leave out any one-off setup done by the first call, and empty the free
+    # lists so that every measurement starts from the same state
+    f([], -1)
+    f.clear_cache()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for i, v in enumerate(values):
+            f(v, i)
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+def test_size():
+    """ Make sure that compact keys don't use more memory than plain keys """
+    shared = list(range(50) )
+    repeated = [shared]*200
+    distinct = [[(i, j) for j in range(50)] for i in range(200)]
+    for values in (repeated, distinct):
+        plain = cache_memory(values)
+        # Verified keys also store a digest, so distinct arguments cost a
+        # little more than plain keys
+        assert cache_memory(values, compact_keys=True) < 1.2*plain
+        assert cache_memory(
+                values, compact_keys=True, verify_keys=False) < 0.2*plain
+    assert cache_memory(repeated, compact_keys=True) < \
+            0.8*cache_memory(repeated)
@@ -0,0 +1,119 @@
+""" Tests for the fast path used by locked MemoClasses """
+
+from memoclass.memoize import (
+        memomethod, MemoFunc, FrozenMemoFunc, LockMemoFunc)
+from memoclass.memoclass import MemoClass
+from fractions import Fraction
+import gc
+import pytest
+
+class Scaler(MemoClass):
+    def __init__(self, factor):
+        super(Scaler, self).__init__(mutable_attrs=["call_count"])
+        self.factor = factor
+        self.call_count = 0
+
+    @memomethod
+    def scale(self, x, offset=0):
+        """ Scale x """
+        self.call_count += 1
+        return x * self.factor + offset
+
+def test_frozen():
+    """ Make sure that locked objects reuse their bound functions """
+    s = Scaler(2)
+    assert isinstance(s.scale, LockMemoFunc)
+    assert s.scale is not s.scale
+    s.lock()
+    assert isinstance(s.scale, FrozenMemoFunc)
+    assert s.scale.__dict__ is s.scale.__dict__
+    assert s.scale(3) == 6
+    assert s.scale(3) == 6
+    assert s.scale(x=3) == 6
+    assert s.scale(3, offset=1) == 7
+    assert s.call_count == 2
+    with pytest.raises(ValueError):
+        s.factor = 3
+
+def test_unlock():
+    """ Make sure that unlocking goes back to the normal dispatch """
+    s = Scaler(2)
+    s.lock()
+    assert s.scale(3) == 6
+    s.unlock(clear_caches=False)
+    assert isinstance(s.scale, LockMemoFunc)
+    s.factor = 3
+    assert s.scale(3) == 9
+    with s.locked():
+        assert s.scale.__dict__ is s.scale.__dict__
+        assert s.scale(3) == 9
+    assert s.call_count == 2
+
+def test_invalidate():
+    """ Make sure that invalidating the caches also affects locked objects """
+    s = Scaler(2)
+    s.lock()
+    s.scale(3)
+    frozen = s.scale.__dict__
+    Scaler.scale.invalidate()
+    assert s.scale.__dict__ is not frozen
+    s.scale(3)
+    assert s.call_count == 2
+    Scaler.scale.clear_cache()
+    s.scale(3)
+    assert s.call_count == 3
+
+def test_keys():
+    """ Make sure that only keys for simple arguments are remembered """
+    s = Scaler(2)
+    s.lock()
+    s.scale(3)
+    s.scale(Fraction(1, 2) )
+    s.scale(3, offset=1)
+    assert list(s.scale._keys) == [(3,)]
+    assert s.scale(Fraction(1, 2) ) == 1
+    assert s.call_count == 3
+
+def test_delete():
+    """ Make sure that the object can still be garbage collected """
+    gc.collect()
+    n = len(Scaler.scale._frozen)
+    s = Scaler(2)
+    s.lock()
+    s.scale(3)
+    assert len(Scaler.scale._frozen) == n + 1
+    del s
+    gc.collect()
+    assert len(Scaler.scale._frozen) == n
+
+def test_temporary():
+    """ Make sure that the bound function keeps a locked object alive """
+    def make_scaler():
+        s = Scaler(2)
+        s.lock()
+        s.scale(3)
+        return s
+    assert make_scaler().scale(3) == 6
+    scale = make_scaler().scale
+    gc.collect()
+    assert scale(3) == 6
+    assert scale(4) == 8
+
+def test_introspection():
+    """ Make sure that locking doesn't change how the method looks """
+    s = Scaler(2)
+    unlocked = s.scale
+    s.lock()
+    for name in ("__doc__", "__module__", "__name__"):
+        assert getattr(s.scale, name) == getattr(unlocked, name)
+    assert s.scale.__doc__ == " Scale x "
+    assert isinstance(s.scale, MemoFunc)
+
+def test_disable():
+    """ Make sure that the caches of a locked object can't be disabled """
+    s = Scaler(2)
+    s.lock()
+    s.disable_caches()
+    s.scale(1)
+    s.scale(1)
+    assert s.call_count == 1
@@ -0,0 +1,103 @@
+""" Tests for generation based invalidation """
+
+from memoclass.memoize import memomethod, memoclsmethod
+from memoclass.memoclass import MemoClass
+import gc
+
+scale = 1
+class Scaled(MemoClass):
+    def __init__(self, value):
+        super(Scaled, self).__init__(mutable_attrs=["call_count"])
+        self.value = value
+        self.call_count = 0
+
+    @memomethod
+    def scaled(self):
+        self.call_count += 1
+        return self.value * scale
+
+    @memoclsmethod
+    def cls_scale(cls):
+        return scale
+
+def test_invalidate():
+    """ Make sure that invalidating a method affects every object """
+    global scale
+    scale = 1
+    objs = [Scaled(x) for x in range(3)]
+    assert [o.scaled() for o in objs] == [0, 1, 2]
+    scale = 2
+    assert [o.scaled() for o in objs] == [0, 1, 2]
+    Scaled.scaled.invalidate()
+    assert [o.scaled() for o in objs] == [0, 2, 4]
+    assert [o.call_count for o in objs] == [2, 2, 2]
+    assert [o.scaled() for o in objs] == [0, 2, 4]
+    assert [o.call_count for o in objs] == [2, 2, 2]
+
+def test_lazy():
+    """ Make sure that stale caches are only cleared when used """
+    objs = [Scaled(x) for x in range(3)]
+    for o in objs:
+        o.scaled()
+    Scaled.scaled.invalidate()
+    assert all(len(Scaled.scaled._bound_caches[id(o)]) == 1 for o in objs)
+    objs[0].scaled()
+    assert len(Scaled.scaled._bound_caches[id(objs[1])]) == 1
+
+def test_sweep():
+    """ Make sure that sweeping clears stale caches incrementally """
+    objs = [Scaled(x) for x in range(3)]
+    for o in objs:
+        o.scaled()
+    Scaled.scaled.invalidate()
+    assert Scaled.scaled.sweep(limit=2) == 2
+    assert Scaled.scaled.sweep() == 1
+    assert Scaled.scaled.sweep() == 0
+    assert all(len(Scaled.scaled._bound_caches[id(o)]) == 0 for o in objs)
+
+def test_sweep_resumes():
+    """ Make sure that each sweep carries on from where the last one stopped """
+    Scaled.scaled.clear_cache()
+    objs = [Scaled(x) for x in range(10)]
+    for o in objs:
+        o.scaled()
+    Scaled.scaled.invalidate()
+    # Already cleared caches count towards the limit but aren't cleared again
+    objs[0].scaled()
+    objs[1].scaled()
+    del objs[2]
+    gc.collect()
+    assert Scaled.scaled.sweep(limit=3) == 1
+    assert Scaled.scaled._unswept == 7
+    assert Scaled.scaled.sweep(limit=3) == 3
+    assert Scaled.scaled.sweep(limit=3) == 3
+    assert Scaled.scaled.sweep(limit=3) == 0
+    assert Scaled.scaled._unswept == 0
+    assert all(len(Scaled.scaled._bound_caches[id(o)]) == 0 for o in objs[2:])
+    Scaled.scaled.invalidate()
+    assert Scaled.scaled.sweep() == 9
+
+def test_class():
+    """ Make sure that invalidating a class invalidates its methods """
+    global scale
+    scale = 1
+    o = Scaled(3)
+    assert o.scaled() == 3
+    assert Scaled.cls_scale() == 1
+    scale = 2
+    Scaled.invalidate_caches()
+    assert o.scaled() == 6
+    assert Scaled.cls_scale() == 1
+    Scaled.invalidate_caches(clsmethods=True)
+    assert Scaled.cls_scale() == 2
+
+def test_clsmethod_cleanup():
+    """ Make sure that memoclsmethod caches are removed with their class """
+    class Temp(Scaled):
+        pass
+    n = len(Scaled.__dict__["cls_scale"]._bound_caches)
+    Temp.cls_scale()
+    assert len(Scaled.__dict__["cls_scale"]._bound_caches) == n + 1
+    del Temp
+    gc.collect()
+    assert len(Scaled.__dict__["cls_scale"]._bound_caches) == n
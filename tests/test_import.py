@@ -0,0 +1,68 @@
+""" Benchmark for the cost of importing memoclass
+
+    Each import is done in a fresh interpreter so that nothing is already
+    cached in sys.modules
+"""
+
+import subprocess
+import sys
+import pytest
+
+pytestmark = pytest.mark.skipif(
+        sys.version_info[0] < 3, reason="Python 2 needs the compatibility layer")
+
+# Modules which should not be imported just by importing memoclass
+deferred = ("future", "funcsigs", "inspect", "threading", "copy", "timeit",
+            "memoclass.caches")
+
+def run(code):
+    """ Run code in a fresh interpreter, returning its stdout and stderr """
+    proc = subprocess.Popen(
+            [sys.executable, "-X", "importtime", "-c", code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+    out, err = proc.communicate()
+    assert proc.returncode == 0, err
+    return out, err
+
+def import_time(err, module):
+    """ Get the cumulative import time of a module in microseconds """
+    for line in err.splitlines():
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    raise ValueError("Module {0} not imported".format(module) )
+
+def test_deferred():
+    """ Make sure that optional modules are not imported up front """
+    out, _ = run(
+            "import sys, memoclass.memoclass, memoclass.memoize\n"
+            "print('\\n'.join(sys.modules))")
+    loaded = set(out.split() )
+    for module in deferred:
+        assert module not in loaded
+
+def test_decorate():
+    """ Make sure that decorating does not need the deferred modules """
+    out, _ = run(
+            "import sys\n"
+            "from memoclass.memoize import memofunc, memomethod\n"
+            "from memoclass.memoclass import MemoClass\n"
+            "class A(MemoClass):\n"
+            "    @memomethod\n"
+            "    def f(self, x): return x\n"
+            "memofunc(lambda x: x)\n"
+            "print('\\n'.join(sys.modules))")
+    loaded = set(out.split() )
+    assert "inspect" not in loaded
+
+@pytest.mark.skipif(
+        sys.version_info < (3, 7), reason="-X importtime needs python 3.7")
+def test_import_time():
+    """ Benchmark the time to import memoclass
+
+        This only reports the time, as it depends too much on the machine
+    """
+    _, err = run("import memoclass.memoclass")
+    t = import_time(err, "memoclass.memoclass")
+    print("Importing memoclass.memoclass took {0} us".format(t) )
@@ -0,0 +1,90 @@
+""" Tests for per-parameter key policies """
+
+from builtins import object
+from memoclass.memoize import (
+        memofunc, memomethod, IDENTITY, IGNORE, STRUCTURE)
+import pytest
+
+class Data(object):
+    """ Large, unhashable object """
+    def __init__(self, values):
+        self.values = values
+
+    def _to_hashable(self):
+        raise AssertionError("Should not build a structural key")
+
+call_count = 0
+@memofunc(key_policy={"data" : IDENTITY, "log" : IGNORE, "n" : STRUCTURE,
+                      "name" : str.lower})
+def total(data, n, log=None, name=""):
+    global call_count
+    call_count += 1
+    if log is not None:
+        log.append(name)
+    return sum(data.values[:n])
+
+class Summer(object):
+    @memomethod(key_policy={"data" : IDENTITY})
+    def total(self, data):
+        return sum(data.values)
+
+def reset():
+    global call_count
+    call_count = 0
+    total.clear_cache()
+
+def test_identity():
+    """ Make sure that arguments are compared by identity """
+    reset()
+    a = Data([1, 2, 3])
+    b = Data([1, 2, 3])
+    assert total(a, 2) == 3
+    assert total(a, 2) == 3
+    assert call_count == 1
+    total(b, 2)
+    assert call_count == 2
+
+def test_eviction():
+    """ Make sure that entries are removed when the argument is deleted """
+    reset()
+    a = Data([1, 2, 3])
+    total(a, 2)
+    total(a, 3)
+    assert len(total._cache) == 2
+    a = None
+    assert len(total._cache) == 0
+
+def test_ignore():
+    """ Make sure that ignored arguments don't affect the key """
+    reset()
+    a = Data([1, 2, 3])
+    log = []
+    total(a, 2, log)
+    total(a, 2, [])
+    total(a, 2)
+    assert call_count == 1
+    assert log == [""]
+
+def test_key_function():
+    """ Make sure that a key function is applied to the argument """
+    reset()
+    a = Data([1, 2, 3])
+    total(a, 2, name="Hello")
+    total(a, 2, name="HELLO")
+    assert call_count == 1
+    total(a, 2, name="World")
+    assert call_count == 2
+
+def test_method():
+    """ Make sure that key policies work on methods """
+    s = Summer()
+    a = Data([1, 2])
+    assert s.total(a) == 3
+    assert len(Summer.total.get_cache(s) ) == 1
+    a = None
+    assert len(Summer.total.get_cache(s) ) == 0
+
+def test_unknown_parameter():
+    """ Make sure that a policy on an unknown parameter is rejected """
+    with pytest.raises(ValueError):
+        memofunc(lambda x: x, key_policy={"y" : IGNORE})
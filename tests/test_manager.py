@@ -0,0 +1,105 @@
+""" Tests for the process-wide cache manager """
+
+from builtins import object
+from memoclass.memoize import memofunc, memomethod
+from memoclass.memoclass import MemoClass
+from memoclass.manager import cache_manager, _estimate_size, _evict
+from memoclass.caches import TieredCache, LRUCache
+import gc
+import sys
+
+@memofunc
+def build(x):
+    return [x]*100
+
+class Builder(object):
+    @memomethod
+    def build(self, x):
+        return [x]*100
+
+class Versioned(MemoClass):
+    versioned_caches = True
+
+    @memomethod
+    def build(self, x):
+        return [x]*1000
+
+def fill():
+    build.clear_cache()
+    for x in range(10):
+        build(x)
+    b = Builder()
+    for x in range(10):
+        b.build(x)
+    return b
+
+def test_registry():
+    """ Make sure that functions and methods are registered """
+    b = fill()
+    caches = cache_manager.caches()
+    assert any(c is build._cache for c in caches)
+    assert any(c is Builder.build.get_cache(b) for c in caches)
+    assert cache_manager.estimate_size() > 20*sys.getsizeof([0]*100)
+
+def test_purge():
+    """ Make sure that purging removes the oldest entries """
+    b = fill()
+    cache_manager.purge(0.5)
+    assert len(build._cache) == 5
+    assert len(Builder.build.get_cache(b) ) == 5
+    assert build._make_key((9,), {}) in build._cache
+    assert build._make_key((0,), {}) not in build._cache
+    cache_manager.purge()
+    assert len(build._cache) == 0
+
+def test_trim():
+    """ Make sure that trimming reduces the estimated size """
+    b = fill()
+    cache_manager.trim_to(cache_manager.estimate_size() // 2)
+    assert len(build._cache) < 10
+    assert len(Builder.build.get_cache(b) ) < 10
+
+def test_gc_callback():
+    """ Make sure that the limits are applied after garbage collection """
+    b = fill()
+    cache_manager.install(max_bytes=0)
+    try:
+        gc.collect()
+    finally:
+        cache_manager.uninstall()
+    assert len(build._cache) == 0
+    assert len(Builder.build.get_cache(b) ) == 0
+
+def test_stale_entries():
+    """ Make sure that out of date versioned entries are released """
+    v = Versioned()
+    for x in range(10):
+        v.build(x)
+    cache = Versioned.build.get_cache(v)
+    assert _estimate_size(cache) > 10*sys.getsizeof([0]*1000)
+    v.mutate()
+    assert _estimate_size(cache) < sys.getsizeof([0]*1000)
+    assert len(cache._inner) == 0
+    for x in range(10):
+        v.build(x)
+    v.mutate()
+    v.build(0)
+    # The nine stale entries are more than half of the cache
+    assert _evict(cache, 0.5) == 9
+    assert len(cache._inner) == 1
+
+def test_tiered():
+    """ Make sure that only the in-memory tier of a tiered cache is released
+    """
+    shared = {}
+    cache = TieredCache(shared, LRUCache(20) )
+    for x in range(10):
+        cache[x] = [x]*1000
+    assert _estimate_size(cache) == \
+            _estimate_size(cache.l1) + _estimate_size(cache._pending)
+    assert _evict(cache, 0.5) == 5
+    assert len(cache.l1) == 5
+    assert len(shared) == 10
+    assert _evict(cache, 1) == 5
+    assert len(shared) == 10
+    assert cache[0] == [0]*1000
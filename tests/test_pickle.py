@@ -0,0 +1,94 @@
+""" Tests for pickling MemoClass objects along with their caches """
+
+from memoclass.memoclass import MemoClass
+from memoclass.memoize import memomethod
+from memoclass.caches import LRUCache, CompactKeyCache
+import copy
+import pickle
+
+class Squares(MemoClass):
+    pickle_caches = True
+
+    def __init__(self, offset):
+        super(Squares, self).__init__(mutable_attrs=["call_count"])
+        self.offset = offset
+        self.call_count = 0
+
+    @memomethod
+    def square(self, x):
+        self.call_count += 1
+        return (x + self.offset)**2
+
+    @memomethod
+    def cube(self, x):
+        self.call_count += 1
+        return (x + self.offset)**3
+
+class SquaresLRU(Squares):
+    @memomethod(cache_cls=LRUCache, compact_keys=True)
+    def square(self, x):
+        self.call_count += 1
+        return (x + self.offset)**2
+
+class SquaresNoCache(Squares):
+    pickle_caches = False
+
+class SquaresFiltered(Squares):
+    pickle_caches = ("square",)
+
+def test_roundtrip():
+    """ Make sure that the caches survive pickling """
+    a = Squares(1)
+    assert a.square(2) == 9
+    b = pickle.loads(pickle.dumps(a) )
+    assert b.call_count == 1
+    assert b.square(2) == 9
+    assert b.call_count == 1
+    # The two objects should not share caches
+    b.offset = 2
+    assert b.square(2) == 16
+    assert a.square(2) == 9
+
+def test_no_caches():
+    """ Make sure that caches are not pickled by default """
+    a = SquaresNoCache(1)
+    a.square(2)
+    b = pickle.loads(pickle.dumps(a) )
+    b.square(2)
+    assert b.call_count == 2
+
+def test_filter():
+    """ Make sure that only the selected caches are pickled """
+    a = SquaresFiltered(1)
+    a.square(2)
+    a.cube(2)
+    b = pickle.loads(pickle.dumps(a) )
+    b.square(2)
+    assert b.call_count == 2
+    b.cube(2)
+    assert b.call_count == 3
+
+def test_copy():
+    """ Make sure that a copied object does not share its cache """
+    a = Squares(1)
+    a.square(2)
+    b = copy.copy(a)
+    assert b.square(2) == 9
+    assert b.call_count == 1
+    b.offset = 2
+    assert a.square(2) == 9
+
+def test_copy_cache_type():
+    """ Make sure that copies of non-dict caches are independent """
+    a = SquaresLRU(1)
+    a.square(2)
+    b = copy.copy(a)
+    cache_a = SquaresLRU.square.get_cache(a)
+    cache_b = SquaresLRU.square.get_cache(b)
+    assert isinstance(cache_b, CompactKeyCache)
+    assert isinstance(cache_b._inner, LRUCache)
+    assert cache_a._inner is not cache_b._inner
+    assert b.square(2) == 9
+    assert b.call_count == 1
+    cache_b.clear()
+    assert len(cache_a) == 1
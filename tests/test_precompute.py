@@ -0,0 +1,116 @@
+""" Tests for precomputing memomethods when locking a MemoClass """
+
+from memoclass.memoize import memomethod
+from memoclass.memoclass import MemoClass, precompute
+import pytest
+
+class Polynomial(MemoClass):
+    def __init__(self, coeffs):
+        super(Polynomial, self).__init__(mutable_attrs=["call_count"])
+        self.coeffs = coeffs
+        self.call_count = 0
+
+    @memomethod
+    def degree(self):
+        self.call_count += 1
+        return len(self.coeffs) - 1
+
+    @memomethod
+    def evaluate(self, x, scale=1):
+        self.call_count += 1
+        return scale * sum(c * x**i for i, c in enumerate(self.coeffs) )
+
+class Failing(MemoClass):
+    @memomethod
+    def fail(self):
+        raise RuntimeError("Failed")
+
+class Sequence(MemoClass):
+    @memomethod(replay=True)
+    def items(self):
+        for i in range(1, 3):
+            yield i
+
+    @memomethod(on_return=list)
+    def copied(self):
+        return (1, 2)
+
+def test_lock():
+    """ Make sure that locking precomputes the requested values """
+    p = Polynomial([1, 2])
+    p.lock(precompute=["degree", ("evaluate", (2,) ),
+                       ("evaluate", (2,), {"scale" : 2})])
+    assert p.call_count == 3
+    assert p.degree() == 1
+    assert p.evaluate(2) == 5
+    assert p.evaluate(2, scale=2) == 10
+    assert p.call_count == 3
+
+def test_locked():
+    """ Make sure that the locked context manager precomputes values """
+    p = Polynomial([1, 2])
+    p.disable_caches()
+    with p.locked(precompute=["degree"]):
+        assert p.call_count == 1
+        p.degree()
+        assert p.call_count == 1
+    p.degree()
+    assert p.call_count == 2
+
+def test_many():
+    """ Make sure that many objects can be precomputed together """
+    objs = [Polynomial([i, 1]) for i in range(3)]
+    precompute(objs, [("evaluate", (1,) )])
+    assert all(p.is_locked for p in objs)
+    assert [p.evaluate(1) for p in objs] == [1, 2, 3]
+    assert all(p.call_count == 1 for p in objs)
+
+@pytest.mark.parametrize("pool", ["ThreadPoolExecutor", "ProcessPoolExecutor"])
+def test_executor(pool):
+    """ Make sure that precomputing works on an executor """
+    futures = pytest.importorskip("concurrent.futures")
+    objs = [Polynomial([i, 1]) for i in range(3)]
+    with getattr(futures, pool)(max_workers=2) as executor:
+        precompute(objs, ["degree", ("evaluate", (1,) )], executor)
+    assert [p.evaluate(1) for p in objs] == [1, 2, 3]
+    assert [p.degree() for p in objs] == [1, 1, 1]
+    if pool == "ProcessPoolExecutor":
+        # The calls were made on copies of the objects
+        assert all(p.call_count == 0 for p in objs)
+    else:
+        assert all(p.call_count == 2 for p in objs)
+
+@pytest.mark.parametrize("pool", ["ThreadPoolExecutor", "ProcessPoolExecutor"])
+def test_executor_raw(pool):
+    """ Make sure that the raw cached values are kept when using an executor
+    """
+    futures = pytest.importorskip("concurrent.futures")
+    s = Sequence()
+    with getattr(futures, pool)(max_workers=2) as executor:
+        precompute([s], ["copied"], executor)
+        if pool == "ProcessPoolExecutor":
+            with pytest.raises(ValueError):
+                precompute([Sequence()], ["items"], executor)
+        else:
+            precompute([s], ["items"], executor)
+            assert list(s.items() ) == [1, 2]
+            assert list(s.items() ) == [1, 2]
+    assert Sequence.copied.get_cache(s)[
+            s.copied._make_key((), {})] == (1, 2)
+    assert s.copied() == [1, 2]
+
+def test_failure():
+    """ Make sure that a failed precompute call doesn't leave objects locked
+    """
+    f = Failing()
+    with pytest.raises(RuntimeError):
+        with f.locked(precompute=["fail"]):
+            pass
+    assert not f.is_locked
+    with pytest.raises(RuntimeError):
+        f.lock(precompute=["fail"])
+    assert not f.is_locked
+    f.lock()
+    with pytest.raises(RuntimeError):
+        f.lock(precompute=["fail"])
+    assert f.is_locked
@@ -0,0 +1,120 @@
+""" Tests for the recursion optimised mode """
+
+from memoclass.memoize import memofunc, memomethod
+from memoclass.memoclass import MemoClass
+import sys
+import pytest
+
+call_count = 0
+@memofunc(recursive=True)
+def fib(n):
+    global call_count
+    call_count += 1
+    return n if n < 2 else fib(n-1) + fib(n-2)
+
+@memofunc(recursive=True)
+def path_sum(path, start=0):
+    """ Sum a list, recursing over its elements """
+    if start == len(path):
+        return 0
+    return path[start] + path_sum(path, start + 1)
+
+class Tree(MemoClass):
+    def __init__(self, depth):
+        super(Tree, self).__init__(mutable_attrs=["call_count"])
+        self.depth = depth
+        self.call_count = 0
+
+    @memomethod(recursive=True)
+    def count(self, level=0):
+        self.call_count += 1
+        if level == self.depth:
+            return 1
+        return 1 + 2 * self.count(level + 1)
+
+def reset():
+    global call_count
+    call_count = 0
+    fib.clear_cache()
+
+def test_fib():
+    """ Make sure that the results and caching are correct """
+    reset()
+    assert fib(30) == 832040
+    assert call_count == 31
+    assert fib(20) == 6765
+    assert call_count == 31
+
+def test_keys():
+    """ Make sure that the fast and slow key paths match """
+    reset()
+    fib(5)
+    fib(n=5)
+    assert call_count == 6
+    fib.rm_from_cache(n=5)
+    fib(5)
+    assert call_count == 7
+    assert path_sum([1, 2, 3]) == 6
+    assert path_sum((1, 2, 3), start=0) == 6
+
+def test_evaluate():
+    """ Make sure that deep recursions can be evaluated """
+    reset()
+    n = 5*sys.getrecursionlimit()
+    with pytest.raises(RecursionError):
+        fib(n)
+    reset()
+    assert fib.evaluate((n,) ) == fib.evaluate((n,) )
+    # Abandoned calls are retried, but each one is only retried once
+    assert n + 1 <= call_count <= 2*(n + 1)
+    reset()
+    assert fib.evaluate(kwargs={"n" : 100}, max_depth=7) == \
+            354224848179261915075
+
+def test_evaluate_needs_recursive():
+    """ Make sure that evaluate is only allowed in recursive mode """
+    with pytest.raises(ValueError):
+        memofunc(lambda x: x).evaluate((1,) )
+
+def test_method():
+    """ Make sure that recursive methods reuse their bound function """
+    t = Tree(10)
+    assert t.count() == 2**11 - 1
+    assert t.call_count == 11
+    assert not Tree.count._active
+    assert not t.is_locked
+
+def test_method_evaluate():
+    """ Make sure that deep recursive methods can be evaluated """
+    t = Tree(3*sys.getrecursionlimit() )
+    assert t.count.evaluate(max_depth=50) == 2**(t.depth + 1) - 1
+    assert t.call_count <= 2*(t.depth + 1)
+    assert not t.is_locked
+
+def max_depth(decorator):
+    """ Find the deepest recursion a decorated function can reach """
+    @decorator
+    def chain(n):
+        return 0 if n == 0 else chain(n - 1) + 1
+    lo, hi = 1, sys.getrecursionlimit()
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if hasattr(chain, "clear_cache"):
+            chain.clear_cache()
+        try:
+            chain(mid)
+            lo = mid
+        except RecursionError:
+            hi = mid - 1
+    return lo
+
+def test_depth():
+    """ Make sure that each level of recursion only adds one frame """
+    bare = max_depth(lambda f: f)
+    recursive = max_depth(memofunc(recursive=True) )
+    plain = max_depth(memofunc)
+    assert recursive >= plain
+    assert plain >= bare // 3 - 10
+    # Calling the memofunc object counts as more than one level of the
+    # interpreter's recursion limit on some versions
+    assert recursive >= bare // 3 - 10
@@ -0,0 +1,120 @@
+""" Tests for memoizing generator functions """
+
+from builtins import object
+from memoclass.memoize import memofunc, memomethod
+from itertools import islice
+import pytest
+
+produced = []
+@memofunc(replay=True)
+def count_to(n):
+    """ Generate the numbers up to n, recording each one produced """
+    for i in range(n):
+        produced.append(i)
+        yield i
+
+@memofunc(replay=True, replay_limit=3)
+def count_to_limited(n):
+    for i in range(n):
+        produced.append(i)
+        yield i
+
+@memofunc(replay=True)
+def fail_after(n):
+    for i in range(n):
+        yield i
+    raise ValueError("Failed after {0} items".format(n) )
+
+fail = [True]
+@memofunc(replay=True)
+def transient(n):
+    for i in range(n):
+        if fail[0]:
+            raise IOError("Transient failure")
+        yield i
+
+class Counter(object):
+    def __init__(self, start):
+        self.start = start
+
+    @memomethod(replay=True)
+    def count_to(self, n):
+        for i in range(self.start, n):
+            produced.append(i)
+            yield i
+
+def reset():
+    del produced[:]
+    count_to.clear_cache()
+    count_to_limited.clear_cache()
+
+def test_replay():
+    """ Make sure that every caller sees the full sequence """
+    reset()
+    assert list(count_to(5) ) == [0, 1, 2, 3, 4]
+    assert list(count_to(5) ) == [0, 1, 2, 3, 4]
+    assert produced == [0, 1, 2, 3, 4]
+
+def test_lazy():
+    """ Make sure that items are only produced when they are needed """
+    reset()
+    a = count_to(5)
+    assert list(islice(a, 2) ) == [0, 1]
+    assert produced == [0, 1]
+    b = count_to(5)
+    assert list(islice(b, 3) ) == [0, 1, 2]
+    assert produced == [0, 1, 2]
+    # The two iterators are independent
+    assert next(a) == 2
+    assert list(a) == [3, 4]
+    assert list(b) == [3, 4]
+    assert produced == [0, 1, 2, 3, 4]
+
+def test_limit():
+    """ Make sure that readers beyond the limit recompute the sequence """
+    reset()
+    a = count_to_limited(5)
+    b = count_to_limited(5)
+    assert list(a) == [0, 1, 2, 3, 4]
+    assert produced == [0, 1, 2, 3, 4]
+    assert list(b) == [0, 1, 2, 3, 4]
+    assert produced == [0, 1, 2, 3, 4, 0, 1, 2, 3, 4]
+    # Readers staying within the buffer do not recompute anything
+    assert list(islice(count_to_limited(5), 3) ) == [0, 1, 2]
+    assert len(produced) == 10
+
+def test_method():
+    """ Make sure that generator methods can be replayed """
+    reset()
+    c = Counter(2)
+    assert list(c.count_to(4) ) == [2, 3]
+    assert list(c.count_to(4) ) == [2, 3]
+    assert produced == [2, 3]
+
+def test_error():
+    """ Make sure that an error in the source is seen by every reader """
+    fail_after.clear_cache()
+    a = fail_after(1)
+    b = fail_after(1)
+    assert next(b) == 0
+    with pytest.raises(ValueError):
+        list(a)
+    with pytest.raises(ValueError):
+        next(b)
+    with pytest.raises(ValueError):
+        list(fail_after(1) )
+
+def test_transient_error():
+    """ Make sure that a failed sequence is recomputed by later calls """
+    transient.clear_cache()
+    fail[0] = True
+    a = transient(2)
+    b = transient(2)
+    with pytest.raises(IOError):
+        next(a)
+    fail[0] = False
+    # Existing readers still see the error
+    with pytest.raises(IOError):
+        next(b)
+    assert list(transient(2) ) == [0, 1]
+    assert list(transient(2) ) == [0, 1]
@@ -0,0 +1,84 @@
+""" Tests for the tiered cache """
+
+from memoclass.memoize import memofunc, memomethod
+from memoclass.memoclass import MemoClass
+from memoclass.caches import TieredCache, LRUCache
+
+shared = {}
+call_count = 0
+@memofunc(cache=TieredCache(shared, LRUCache(2) ) )
+def square(x):
+    global call_count
+    call_count += 1
+    return x*x
+
+class Offset(MemoClass):
+    def __init__(self, offset):
+        super(Offset, self).__init__()
+        self.offset = offset
+
+    @memomethod(cache_cls=lambda: TieredCache({}, write_back=True) )
+    def add(self, x):
+        return x + self.offset
+
+def reset():
+    global call_count
+    call_count = 0
+    square.clear_cache()
+
+def test_lru():
+    """ Make sure that the LRU cache keeps the most recently used entries """
+    cache = LRUCache(2)
+    cache[1] = 1
+    cache[2] = 2
+    cache[1]
+    cache[3] = 3
+    assert sorted(cache) == [1, 3]
+
+def test_promote():
+    """ Make sure that L2 hits are promoted into L1 """
+    reset()
+    for x in range(4):
+        square(x)
+    assert len(square._cache.l1) == 2
+    assert len(shared) == 4
+    key = square._make_key((0,), {})
+    assert key not in square._cache.l1
+    assert square(0) == 0
+    assert call_count == 4
+    assert key in square._cache.l1
+
+def test_invalidate():
+    """ Make sure that invalidation reaches every tier """
+    reset()
+    square(2)
+    square(3)
+    square.rm_from_cache(2)
+    assert list(shared) == [square._make_key((3,), {})]
+    square.clear_cache()
+    assert len(shared) == 0
+    assert len(square._cache.l1) == 0
+
+def test_write_back():
+    """ Make sure that write-back values reach L2 when flushed """
+    cache = TieredCache({}, write_back=True, batch_size=3)
+    cache[1] = 1
+    cache[2] = 2
+    assert len(cache.l2) == 0
+    assert cache[1] == 1
+    cache[3] = 3
+    assert len(cache.l2) == 3
+    cache[4] = 4
+    cache.flush()
+    assert len(cache.l2) == 4
+
+def test_mutate():
+    """ Make sure that mutating a MemoClass clears every tier """
+    o = Offset(1)
+    assert o.add(1) == 2
+    cache = Offset.add.get_cache(o)
+    cache.flush()
+    assert len(cache.l2) == 1
+    o.offset = 2
+    assert len(cache.l2) == 0
+    assert o.add(1) == 3
@@ -0,0 +1,142 @@
+""" Tests for pull-based invalidation using versioned caches """
+
+from memoclass.memoize import memomethod
+from memoclass.memoclass import MemoClass
+import pickle
+
+class Provider(MemoClass):
+    versioned_caches = True
+
+    def __init__(self, value):
+        self.value = value
+        super(Provider, self).__init__()
+
+class Receiver(MemoClass):
+    versioned_caches = True
+    pickle_caches = True
+
+    def __init__(self, provider):
+        self.provider = provider
+        super(Receiver, self).__init__(mutable_attrs=["call_count"])
+        self.call_count = 0
+
+    def depends_on(self):
+        return (self.provider,)
+
+    @memomethod
+    def append(self, value):
+        self.call_count += 1
+        return self.provider.value + value
+
+class Chain(Receiver):
+    """ Receiver whose provider is itself a receiver """
+    @memomethod
+    def append(self, value):
+        self.call_count += 1
+        return self.provider.append(value)
+
+def test_cache():
+    """ Make sure that results are still cached """
+    r = Receiver(Provider([1, 2, 3]) )
+    assert r.append([4]) == [1, 2, 3, 4]
+    assert r.append([4]) == [1, 2, 3, 4]
+    assert r.call_count == 1
+
+def test_provider():
+    """ Make sure that mutating the provider invalidates the receiver without
+        the provider knowing about it
+    """
+    p = Provider([1, 2, 3])
+    r = Receiver(p)
+    r.append([4])
+    p.value = [2, 3]
+    assert r.append([4]) == [2, 3, 4]
+    assert r.call_count == 2
+
+def test_self():
+    """ Make sure that mutating the object itself invalidates its results """
+    r = Receiver(Provider([1]) )
+    r.append([2])
+    r.provider = Provider([3])
+    assert r.append([2]) == [3, 2]
+    assert r.call_count == 2
+
+def test_chain():
+    """ Make sure that dependencies are followed recursively """
+    p = Provider([1])
+    c = Chain(Receiver(p) )
+    assert c.append([2]) == [1, 2]
+    p.value = [3]
+    assert c.append([2]) == [3, 2]
+    assert c.call_count == 2
+
+def test_lazy():
+    """ Make sure that stale entries are only removed when read """
+    p = Provider([1])
+    r = Receiver(p)
+    r.append([2])
+    r.append([3])
+    p.value = [4]
+    inner = Receiver.append.get_cache(r)._inner
+    assert len(inner) == 2
+    r.append([2])
+    assert len(inner) == 2
+    assert len(Receiver.append.get_cache(r) ) == 1
+
+def test_pickle():
+    """ Make sure that valid entries survive pickling """
+    p = Provider([1])
+    r = Receiver(p)
+    r.append([2])
+    r.append([3])
+    p.value = [4]
+    r.append([2])
+    r2 = pickle.loads(pickle.dumps(r) )
+    assert r2.append([2]) == [4, 2]
+    assert r2.call_count == 3
+    r2.provider.value = [5]
+    assert r2.append([2]) == [5, 2]
+    assert r2.call_count == 4
+
+class Node(MemoClass):
+    versioned_caches = True
+    pickle_caches = True
+
+    def __init__(self, value):
+        super(Node, self).__init__()
+        self.value = value
+        self.other = None
+
+    def depends_on(self):
+        return () if self.other is None else (self.other,)
+
+    @memomethod
+    def total(self):
+        return self.value + self.other.value
+
+def test_pickle_cycle():
+    """ Make sure that objects depending on each other can be unpickled """
+    a = Node(1)
+    b = Node(2)
+    a.other = b
+    b.other = a
+    assert a.total() == 3
+    assert b.total() == 3
+    a2, b2 = pickle.loads(pickle.dumps((a, b) ) )
+    assert len(Node.total.get_cache(a2) ) == 1
+    assert a2.total() == 3
+    b2.value = 5
+    assert a2.total() == 6
+
+def test_cached_stamp():
+    """ Make sure that stamps are only recalculated after a new version """
+    nodes = [Provider(i) for i in range(100)]
+    r = Receiver(nodes[0])
+    for node, after in zip(nodes, nodes[1:]):
+        node.depends_on = lambda after=after: (after,)
+    stamp = r.memo_stamp()
+    assert len(stamp) == 101
+    assert r.memo_stamp() is stamp
+    nodes[-1].value = 1
+    assert r.memo_stamp() != stamp
+    assert r.memo_stamp()[-1] == nodes[-1]._memo_version
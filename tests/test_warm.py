@@ -0,0 +1,84 @@
+""" Tests for recording key traces and warming caches """
+
+from builtins import object
+from memoclass.memoize import memofunc, memomethod, KeyRecorder
+import pytest
+
+call_count = 0
+@memofunc(recorder=KeyRecorder(max_size=2) )
+def add(a, b=1):
+    global call_count
+    call_count += 1
+    return a + b
+
+class Scaler(object):
+    def __init__(self, factor):
+        self.factor = factor
+        self.call_count = 0
+
+    @memomethod(recorder=True)
+    def scale(self, x):
+        self.call_count += 1
+        return self.factor * x
+
+def reset():
+    global call_count
+    call_count = 0
+    add.clear_cache()
+    add.recorder.clear()
+
+def test_trace():
+    """ Make sure that the most frequent keys are recorded """
+    reset()
+    for _ in range(3):
+        add(1)
+    add(2, b=2)
+    add(2, 2)
+    add(3)
+    # a=1 and b=1 is the same key as a=1
+    add(a=1, b=1)
+    assert len(add.recorder) == 2
+    assert add.recorder.trace() == [((1,), {}), ((2,), {"b" : 2})]
+    assert add.recorder.trace(1) == [((1,), {})]
+
+def test_bound():
+    """ Make sure that the recorder does not grow without bound """
+    reset()
+    for i in range(100):
+        add(i)
+    assert len(add.recorder._entries) < 4
+
+def test_warm():
+    """ Make sure that replaying a trace fills the cache """
+    reset()
+    add(1)
+    add(2, b=2)
+    trace = add.recorder.trace()
+    add.clear_cache()
+    assert add.warm(trace) == 2
+    assert call_count == 4
+    add(1)
+    add(b=2, a=2)
+    assert call_count == 4
+
+def test_warm_executor():
+    """ Make sure that a trace can be replayed on an executor """
+    futures = pytest.importorskip("concurrent.futures")
+    reset()
+    trace = [((i,), {}) for i in range(10)]
+    with futures.ThreadPoolExecutor(max_workers=4) as executor:
+        assert add.warm(trace, executor) == 10
+    assert call_count == 10
+    add(5)
+    assert call_count == 10
+
+def test_method():
+    """ Make sure that traces recorded on one object can warm another """
+    a = Scaler(2)
+    a.scale(3)
+    a.scale(4)
+    b = Scaler(3)
+    Scaler.scale.warm(b, Scaler.scale.recorder.trace() )
+    assert b.call_count == 2
+    assert b.scale(3) == 9
+    assert b.call_count == 2
@@ -0,0 +1,90 @@
+""" Tests for caches holding weak references to their values """
+
+from builtins import object
+from memoclass.memoize import memofunc, memomethod
+from memoclass.caches import WeakValueCache
+from memoclass.memoclass import MemoClass
+import pickle
+
+class Result(object):
+    def __init__(self, value):
+        self.value = value
+
+call_count = 0
+@memofunc(weak_values=2)
+def build(x):
+    global call_count
+    call_count += 1
+    return Result(x)
+
+@memofunc(weak_values=2)
+def build_list(x):
+    global call_count
+    call_count += 1
+    return [x]
+
+class Builder(object):
+    @memomethod(weak_values=True)
+    def build(self, x):
+        return Result(x)
+
+class PickledBuilder(MemoClass):
+    pickle_caches = True
+
+    @memomethod(weak_values=True)
+    def build(self, x):
+        return Result(x)
+
+def reset():
+    global call_count
+    call_count = 0
+    build.clear_cache()
+    build_list.clear_cache()
+
+def test_alive():
+    """ Make sure that values still in use are returned from the cache """
+    reset()
+    results = [build(x) for x in range(5)]
+    assert [build(x) for x in range(5)] == results
+    assert call_count == 5
+
+def test_reclaimed():
+    """ Make sure that unused values are dropped, except for the hottest ones
+    """
+    reset()
+    for x in range(5):
+        build(x)
+    assert len(build._cache) == 2
+    build(4)
+    assert call_count == 5
+    build(0)
+    assert call_count == 6
+
+def test_unweakrefable():
+    """ Make sure that values without weakref support are cached """
+    reset()
+    a = build_list(1)
+    assert build_list(1) is a
+    build_list(2)
+    build_list(3)
+    build_list(1)
+    assert call_count == 4
+
+def test_method():
+    """ Make sure that weak_values works on methods """
+    b = Builder()
+    r = b.build(1)
+    assert b.build(1) is r
+    assert isinstance(Builder.build.get_cache(b), WeakValueCache)
+
+def test_pickle():
+    """ Make sure that weak caches can be pickled with their objects """
+    b = PickledBuilder()
+    result = b.build(1)
+    cache = pickle.loads(pickle.dumps(WeakValueCache(4) ) )
+    assert cache._ring.maxlen == 4
+    c = pickle.loads(pickle.dumps(b) )
+    assert len(PickledBuilder.build.get_cache(c) ) == 1
+    assert c.build(1).value == result.value
+    assert PickledBuilder.build.get_cache(c) is not \
+            PickledBuilder.build.get_cache(b)